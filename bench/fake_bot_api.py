@@ -0,0 +1,118 @@
+# ============================================================
+# Fake Telegram Bot API (bench ke liye, fully offline)
+# ------------------------------------------------------------
+# aiohttp server jo `/bot<token>/<method>` par Telegram jaisa JSON lautata hai.
+# Latency, 429 (RetryAfter), 403 (Forbidden) aur 400 (chat not found) simulate
+# karta hai aur har method ka count + reaction receive time record karta hai.
+# ============================================================
+import json
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+
+def _ok(result):
+    return web.json_response({"ok": True, "result": result})
+
+def _err(code: int, description: str, **parameters):
+    body = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        body["parameters"] = parameters
+    return web.json_response(body, status=code)
+
+class FakeBotAPI:
+    """Configurable stand-in for api.telegram.org.
+
+    forbidden/missing deterministic hain (chat_id hash se), taki retry / resume
+    runs me wahi chats fail hon; flood random hai.
+    """
+
+    def __init__(self, latency_ms: float = 30, jitter_ms: float = 20, flood_rate: float = 0.0,
+                 retry_after: int = 1, forbidden_rate: float = 0.0, missing_rate: float = 0.0,
+                 seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.missing_rate = missing_rate
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.reactions = {}   # (chat_id, message_id) -> perf_counter at receive
+        self._msg_ids = itertools.count(1)
+        self._runner = None
+        self.port = None
+
+    def _fails(self, chat_id: int, rate: float, salt: int) -> bool:
+        return rate > 0 and (hash((chat_id, salt)) % 10_000) < rate * 10_000
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = await request.post()
+        out = {}
+        for k, v in data.items():
+            # PTB non-string values JSON-encode karke bhejta hai
+            try:
+                out[k] = json.loads(v)
+            except (TypeError, ValueError):
+                out[k] = v
+        return out
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+
+        if method == "getMe":
+            return _ok(BOT_USER)
+        if method in ("deleteWebhook", "setWebhook", "answerCallbackQuery"):
+            return _ok(True)
+
+        chat_id = int(params.get("chat_id", 0))
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.errors["429"] += 1
+            return _err(429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after)
+        if self._fails(chat_id, self.forbidden_rate, 1):
+            self.errors["403"] += 1
+            return _err(403, "Forbidden: bot was blocked by the user")
+        if self._fails(chat_id, self.missing_rate, 2):
+            self.errors["400"] += 1
+            return _err(400, "Bad Request: chat not found")
+
+        if method == "setMessageReaction":
+            self.reactions[(chat_id, int(params["message_id"]))] = time.perf_counter()
+            return _ok(True)
+        if method == "copyMessage":
+            return _ok({"message_id": next(self._msg_ids)})
+        if method in ("copyMessages", "forwardMessages"):
+            return _ok([{"message_id": next(self._msg_ids)} for _ in params.get("message_ids", [])])
+        if method in ("sendMessage", "editMessageText"):
+            return _ok({
+                "message_id": int(params.get("message_id") or next(self._msg_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "text": params.get("text", ""),
+            })
+        return _ok(True)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}/bot"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
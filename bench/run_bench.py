@@ -0,0 +1,217 @@
+# ============================================================
+# End-to-end load benchmark (offline)
+# ------------------------------------------------------------
+# bot.py ke asli broadcast aur reaction code paths ko FakeBotAPI + mongomock-motor
+# ke against chalata hai. Report:
+#   - broadcast msgs/s (text + copy + album copies), sent/failed, floods
+#   - reaction p50/p99 latency (submit -> API receive)
+#   - peak RSS
+#   - Mongo operation counts per collection.method
+#
+# Usage:
+#   pip install -r requirements.txt -r bench/requirements.txt
+#   python bench/run_bench.py --chats 10000
+#   python bench/run_bench.py --chats 100000 --rate 500 --json bench_output.json
+#   python bench/run_bench.py --min-rate 20     # CI: rate kam ho to exit 1
+# ============================================================
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mongomock_motor import AsyncMongoMockClient
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+import bot as app_mod
+from fake_bot_api import FakeBotAPI
+
+# bot.py collections lazily (on_startup me) banata hai; bench unki jagah mongomock lagata hai
+COLLECTIONS = {
+    "chats_col": app_mod.COL_CHATS, "admins_col": app_mod.COL_ADMINS,
+    "bclogs_col": app_mod.COL_BCAST_LOGS, "settings_col": app_mod.COL_SETTINGS,
+    "bcjobs_col": app_mod.COL_BCAST_JOBS, "deliveries_col": app_mod.COL_BCAST_DELIV,
+    "schedules_col": app_mod.COL_SCHEDULES,
+}
+NOTIFY_CHAT = 777
+
+class CountingCollection:
+    """Collection proxy jo har public method call ko `ops` me ginta hai."""
+
+    def __init__(self, col, ops: Counter):
+        self._col = col
+        self._ops = ops
+
+    def __getattr__(self, name):
+        attr = getattr(self._col, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        def counted(*args, **kwargs):
+            self._ops[f"{self._col.name}.{name}"] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+def install_mongo(ops: Counter):
+    db = AsyncMongoMockClient()["bench"]
+    for attr, name in COLLECTIONS.items():
+        setattr(app_mod, attr, CountingCollection(db[name], ops))
+    return db
+
+async def seed_chats(n: int):
+    now = app_mod.now_iso()
+    batch = []
+    for i in range(1, n + 1):
+        # ~1/3 private users, baaki groups/channels (negative ids)
+        kind = i % 3
+        cid = i if kind == 0 else -(1_000_000_000_000 + i)
+        batch.append({"_id": cid, "type": ("private", "supergroup", "channel")[kind],
+                      "title": f"chat {i}", "blocked": False, "joined_at": now})
+        if len(batch) == 5000:
+            await app_mod.chats_col.insert_many(batch)
+            batch = []
+    if batch:
+        await app_mod.chats_col.insert_many(batch)
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def bench_broadcast(tg, api: FakeBotAPI, mode: str) -> dict:
+    before = Counter(api.calls)
+    if mode == "text":
+        payload = {"text": "bench broadcast"}
+    elif mode == "copies":
+        payload = {"from_chat_id": NOTIFY_CHAT, "message_ids": [1, 2, 3, 4]}   # 4-part album
+    else:
+        payload = {"from_chat_id": NOTIFY_CHAT, "message_id": 1}
+    bid = await app_mod.enqueue_broadcast(mode, app_mod.OWNER_ID, NOTIFY_CHAT, **payload)
+    job = await app_mod.claim_broadcast_job()
+    t0 = time.perf_counter()
+    await app_mod.run_broadcast_job(tg, job)
+    elapsed = time.perf_counter() - t0
+    totals = await app_mod.broadcast_totals(bid)
+    method = {"text": "sendMessage", "copy": "copyMessage", "copies": "copyMessages"}[mode]
+    calls = api.calls[method] - before[method]
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 2),
+        "sent": totals["success"],
+        "failed": totals["failed"],
+        "api_calls": calls,
+        "msgs_per_s": round(totals["success"] / elapsed, 1) if elapsed else 0.0,
+        "reasons": totals["reasons"],
+    }
+
+async def bench_reactions(tg, api: FakeBotAPI, count: int, chats: int) -> dict:
+    disp = app_mod.reaction_dispatcher
+    workers = [asyncio.create_task(disp.run(tg)) for _ in range(app_mod.REACT_WORKERS)]
+    submitted = {}
+    base = dict(disp.stats)
+    t0 = time.perf_counter()
+    for i in range(count):
+        key = (-(2_000_000_000_000 + i % chats), i + 1)
+        submitted[key] = time.perf_counter()
+        disp.submit(key[0], key[1], app_mod.PRIO_CHANNEL if i % 2 else app_mod.PRIO_MENTION)
+        if i % 200 == 0:
+            await asyncio.sleep(0)
+    done = lambda: sum(disp.stats[k] - base[k] for k in ("sent", "failed", "dropped"))
+    while done() < count:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    lat = [(api.reactions[k] - t) * 1000 for k, t in submitted.items() if k in api.reactions]
+    return {
+        "count": count,
+        "seconds": round(elapsed, 2),
+        "sent": disp.stats["sent"] - base["sent"],
+        "p50_ms": round(pct(lat, 50), 1),
+        "p99_ms": round(pct(lat, 99), 1),
+    }
+
+async def main(args) -> dict:
+    ops = Counter()
+    install_mongo(ops)
+    app_mod.BCAST_RATE = args.rate
+    app_mod.CHAT_MIN_GAP = app_mod.GROUP_MIN_GAP = 0.0   # har chat ek hi baar milta hai
+    app_mod.BCAST_CHECKPOINT = 1.0
+    app_mod.REACT_CHAT_GAP = args.react_gap
+
+    api = FakeBotAPI(latency_ms=args.latency, jitter_ms=args.jitter, flood_rate=args.flood_rate,
+                     forbidden_rate=args.forbidden_rate, missing_rate=args.missing_rate)
+    base_url = await api.start()
+    request = HTTPXRequest(connection_pool_size=256)
+    tg = Bot("0:bench", base_url=base_url, request=request)
+    await tg.initialize()
+
+    report = {"chats": args.chats, "rate_limit": args.rate, "latency_ms": args.latency}
+    try:
+        t0 = time.perf_counter()
+        await seed_chats(args.chats)
+        await app_mod.rebuild_chat_counters()
+        report["seed_seconds"] = round(time.perf_counter() - t0, 2)
+
+        report["broadcast"] = [await bench_broadcast(tg, api, mode) for mode in args.modes]
+        if args.reactions:
+            report["reactions"] = await bench_reactions(tg, api, args.reactions, args.react_chats)
+    finally:
+        await tg.shutdown()
+        await api.stop()
+
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    report["api_calls"] = dict(api.calls)
+    report["api_errors"] = dict(api.errors)
+    report["mongo_ops"] = dict(sorted(ops.items()))
+    return report
+
+def print_report(r: dict):
+    print(f"chats: {r['chats']}  rate limit: {r['rate_limit']}/s  api latency: {r['latency_ms']}ms  "
+          f"(seed {r['seed_seconds']}s)")
+    for b in r["broadcast"]:
+        print(f"broadcast[{b['mode']}]: {b['msgs_per_s']} msg/s  sent {b['sent']}  failed {b['failed']}  "
+              f"in {b['seconds']}s  reasons {b['reasons']}")
+    if "reactions" in r:
+        x = r["reactions"]
+        print(f"reactions: {x['sent']}/{x['count']} in {x['seconds']}s  p50 {x['p50_ms']}ms  p99 {x['p99_ms']}ms")
+    print(f"peak RSS: {r['peak_rss_mb']} MB")
+    print(f"api errors: {r['api_errors']}")
+    print("mongo ops:")
+    for k, v in r["mongo_ops"].items():
+        print(f"  {k:40s} {v}")
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Offline broadcast/reaction load benchmark")
+    p.add_argument("--chats", type=int, default=10_000)
+    p.add_argument("--rate", type=float, default=1000.0, help="BCAST_RATE override (msgs/s)")
+    p.add_argument("--modes", nargs="+", default=["text", "copy"], choices=["text", "copy", "copies"])
+    p.add_argument("--latency", type=float, default=30.0, help="fake API latency (ms)")
+    p.add_argument("--jitter", type=float, default=20.0)
+    p.add_argument("--flood-rate", type=float, default=0.0005)
+    p.add_argument("--forbidden-rate", type=float, default=0.02)
+    p.add_argument("--missing-rate", type=float, default=0.005)
+    p.add_argument("--reactions", type=int, default=2000)
+    p.add_argument("--react-chats", type=int, default=1000)
+    p.add_argument("--react-gap", type=float, default=1.0, help="REACT_CHAT_GAP override")
+    p.add_argument("--json", help="write the report to this file as well")
+    p.add_argument("--min-rate", type=float, default=0.0,
+                   help="exit 1 if any broadcast mode is slower than this (msgs/s)")
+    args = p.parse_args()
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    slow = [b for b in report["broadcast"] if b["msgs_per_s"] < args.min_rate]
+    sys.exit(1 if slow else 0)
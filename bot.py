@@ -4,6 +4,15 @@
 #
 # ENV VARS (recommended) or fill constants below:
 #   BOT_TOKEN, MONGO_URI, OWNER_ID, SUPPORT_URL, PROMO_URL
+#   BOT_MODE=webhook (default polling), WEBHOOK_URL, WEBHOOK_SECRET, PORT
+#   SHARDS=N -> ek router + N shard processes (har shard chat_id hash ka ek hissa)
+#   METRICS_PORT=9090 -> http://127.0.0.1:9090/metrics (Prometheus text; shard k = port+k)
+#
+# Webhook mode locally test karna (WEBHOOK_URL khali -> setWebhook skip hota hai):
+#   BOT_MODE=webhook WEBHOOK_SECRET=s3cret python bot.py
+#   curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: s3cret" \
+#        -H "Content-Type: application/json" -d @update.json localhost:8080/telegram
+# Heroku par webhook ke liye `web: python bot.py` process chahiye (worker nahi).
 #
 # Notes:
 # - Bot cannot auto-join groups/channels from invite links. You (or an admin) must add it.
@@ -14,20 +23,46 @@
 # - /addreaction /delreaction multiple emojis manage karne ke liye (owner only).
 
 import os
+import re
+import io
+import csv
+import gzip
+import json
+import tempfile
+import socket
 import asyncio
 import math
 import random
-from datetime import datetime, timezone
-
+import itertools
+import contextlib
+import threading
+import time
+import hmac
+from collections import deque, OrderedDict
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+
+import queue
+import signal
+import multiprocessing
+from aiohttp import web
+from bson import ObjectId, json_util, encode as bson_encode
+from bson.errors import BSONError
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
 from telegram import (
-    Update, InlineKeyboardMarkup, InlineKeyboardButton, Chat, ChatMemberUpdated,
-    ReactionTypeEmoji
+    Bot, Update, InlineKeyboardMarkup, InlineKeyboardButton, Chat, ChatMemberUpdated,
+    ReactionTypeEmoji, MessageEntity
 )
 from telegram.constants import ParseMode, ChatType
+from telegram.error import (
+    RetryAfter, Forbidden, BadRequest, ChatMigrated, TimedOut, NetworkError
+)
 from telegram.ext import (
     Application, AIORateLimiter, CommandHandler, MessageHandler,
-    CallbackQueryHandler, filters, ContextTypes, ChatMemberHandler
+    CallbackQueryHandler, filters, ContextTypes, ChatMemberHandler,
+    BaseUpdateProcessor
 )
 
 # ===================== CONFIG =====================
@@ -36,6 +71,15 @@ MONGO_URI   = os.getenv("MONGO_URI",   "mongodb://localhost:27017")
 SUPPORT_URL = os.getenv("SUPPORT_URL", "https://t.me/YourSupportHandle")
 PROMO_URL   = os.getenv("PROMO_URL",   "https://t.me/YourPromoHandle")
 
+# Update intake: "polling" (default) ya "webhook" (embedded aiohttp server)
+BOT_MODE        = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL     = os.getenv("WEBHOOK_URL", "").rstrip("/")   # public https base, e.g. https://app.herokuapp.com
+WEBHOOK_PATH    = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET  = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN  = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+PORT            = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = 40
+
 # Permanent Owner ID (fixed)
 OWNER_ID    = 6135117014
 
@@ -44,32 +88,365 @@ COL_CHATS         = "chats"
 COL_ADMINS        = "admins"
 COL_BCAST_LOGS    = "broadcast_logs"
 COL_SETTINGS      = "settings"
+COL_BCAST_JOBS    = "broadcast_jobs"
+COL_BCAST_DELIV   = "broadcast_deliveries"
+COL_SCHEDULES     = "broadcast_schedules"
 
 # Broadcast tuning
 CONCURRENCY = 15
-SLEEP_EVERY = 25
-SLEEP_TIME  = 1.0
+# Token bucket: Telegram global limit ~30 msg/s; flood par rate aadha, phir
+# har second BCAST_RAMP msg/s wapas badhta hai
+BCAST_RATE      = float(os.getenv("BCAST_RATE", "28"))
+BCAST_RATE_MIN  = 3.0
+BCAST_BURST     = 5
+BCAST_RAMP      = 0.5
+BCAST_MAX_FLOOD = 5      # ek chat par itni RetryAfter ke baad failed maan lo
+BCAST_MAX_RETRY = 3      # transient (timeout/network) errors: backoff ke saath retry
+BCAST_BACKOFF   = 1.0
+# Per-chat spacing: private ~1 msg/s, groups/channels ~20 msg/min
+CHAT_MIN_GAP    = 1.0
+GROUP_MIN_GAP   = 3.0
+
+# Broadcast jobs: worker naye jobs itne seconds me check karta hai; heartbeat itna
+# purana ho jaye to job kisi aur instance (ya restart ke baad) se resume hota hai
+BCAST_POLL_INTERVAL = 5.0
+BCAST_STALE_AFTER   = 120
+# Run crash (e.g. Mongo AutoReconnect): cursor checkpoint ho chuka hai, to part backoff
+# (BCAST_ERROR_BACKOFF, har baar double) ke baad dobara queue; itni baar ke baad terminal "error"
+BCAST_MAX_ERRORS    = 5
+BCAST_ERROR_BACKOFF = 15
+BCAST_FETCH         = 500   # chat ids per cursor round-trip
+BCAST_CHECKPOINT    = 2.0   # seconds: ledger flush + cursor/counters save
+BCAST_PROGRESS_EVERY = 5.0  # status message edit throttle (sab shards milake)
+DELIV_TTL_DAYS      = int(os.getenv("DELIV_TTL_DAYS", "30"))  # ledger records itne din baad expire
+
+# Scheduled broadcasts (JobQueue + Mongo)
+SCHEDULE_TZ      = ZoneInfo(os.getenv("SCHEDULE_TZ", "UTC"))  # /schedule HH:MM isi timezone me
+SCHEDULE_SYNC    = 60     # seconds; Mongo se naye/doosre instance ke schedules uthao
+SCHEDULE_PREWARM = 600    # seconds pehle job parts + per-shard target counts bana lo (ids fire par page hote hain)
+SCHEDULE_GRACE   = 3600   # itna late ho gaya (bot down tha) to skip, next run par chalo
+# Har process ka alag id (DYNO naam restart/redeploy aur shards me same rehta hai, isliye
+# pid bhi). Running job sirf stale heartbeat par hi doosra process uthata hai.
+INSTANCE_ID = f"{os.getenv('DYNO') or socket.gethostname()}:{os.getpid()}"
 
 # Defaults
 DEFAULT_REACTION_EMOJI = "👍"
 
+# Sharding: SHARDS>1 par ek router process updates leta hai aur har update ko
+# chat_id ke hash se N shard processes me se ek ko local IPC se bhejta hai
+SHARDS      = max(1, int(os.getenv("SHARDS", "1")))
+SHARD_INDEX = None      # shard process ke andar set hota hai
+SHARD_STATS_EVERY = 15  # seconds; har shard apne runtime counters Mongo me likhta hai
+SHARD_JOIN_TIMEOUT = 25 # SIGTERM ke baad shards ko drain karne ka time (Heroku 30s deta hai)
+POLL_TIMEOUT      = 10  # router ka getUpdates long-poll
+
+# Update processing: alag chats parallel, ek chat ke updates hamesha order me
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_BACKLOG     = 4096   # itne updates tak apni chat ki baari ka wait kar sakte hain
+UPDATE_CHAT_BACKLOG = 256   # ek chat itne se zyada backlog slots na ghere; upar wale drop
+
+# Reaction dispatcher: handler sirf queue karta hai, workers bahar se bhejte hain
+REACT_WORKERS   = 4
+REACT_QUEUE_MAX = 5000   # itne pending ho to naye reactions drop
+REACT_CHAT_GAP  = 1.0    # ek chat me do reactions ke beech min gap (seconds)
+REACT_MAX_TRIES = 3
+REACT_ALBUM_TTL = 60     # media_group_id itni der yaad (album = ek reaction)
+REACT_POLICY_CACHE = 20000  # per-chat policies LRU size
+REACT_POLICY_TTL   = 300    # seconds; doosre instance ke changes itni der me dikhte hain
+
+# Chat registry: dirty chats itne seconds me (max staleness) ya itne jama hone par flush
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "15"))
+CHAT_FLUSH_MAX      = 500
+CHAT_REGISTRY_MAX   = 200_000
+
+# /exportchats, /importchats (registry backup / migration)
+CHAT_EXPORT_BATCH     = 2000   # cursor batch = ek gzip write chunk
+CHAT_IMPORT_BATCH     = 1000   # bulk_write ops per round-trip
+CHAT_EXPORT_MAX_BYTES = 50 * 1024 * 1024   # Bot API upload limit
+CHAT_IMPORT_MAX_BYTES = 20 * 1024 * 1024   # Bot API getFile (download) limit
+CHAT_IMPORT_PROGRESS  = 5.0    # status message edit throttle (seconds)
+
+# Emoji cache: change stream na mile (standalone mongod) to itne seconds me poll
+EMOJI_CACHE_TTL = float(os.getenv("EMOJI_CACHE_TTL", "30"))
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "30"))  # sirf bina change streams ke
+
+# Mongo client: startup (event loop ke andar) banta hai, explicit pool + timeouts ke saath.
+# Free/shared clusters ~500 connections dete hain; SHARDS x pool usse neeche rakho.
+MONGO_POOL_MAX      = int(os.getenv("MONGO_POOL_MAX", "50"))
+MONGO_POOL_MIN      = int(os.getenv("MONGO_POOL_MIN", "4"))     # warm connections, pehle updates ke liye
+MONGO_CONNECT_MS    = 5000
+MONGO_SELECT_MS     = 5000    # primary na mile to itni der me error (default 30s bahut hai)
+MONGO_SOCKET_MS     = 60000   # rebuild_chat_counters jaisi lambi aggregations bhi fit hon
+MONGO_WAIT_QUEUE_MS = 10000   # pool full ho to checkout ka max wait
+MONGO_STARTUP_TRIES = 5       # health check retries (2s, 4s, ...) ke baad crash -> dyno restart
+
+# Graceful stop: SIGTERM ke baad Heroku 30s deta hai. Intake band -> pending updates
+# -> reaction queue / broadcast in-flight sends / chat writes itne seconds me drain.
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+# ===================== METRICS =====================
+# Chhota in-process registry (koi extra dependency nahi). /metrics Prometheus text
+# format deta hai, /perf owner ko recent p50/p99 summary dikhata hai.
+METRICS_PORT   = int(os.getenv("METRICS_PORT", "0"))   # 0 = /metrics server band
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_SAMPLES = 512   # per series recent samples (/perf quantiles)
+
+class Metrics:
+    """Counters + histograms keyed by (name, labels); gauges render time par compute hote hain.
+
+    Mongo listener pymongo ke threads se call karta hai, isliye lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.hists = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        k = self._key(name, labels)
+        with self._lock:
+            self.counters[k] = self.counters.get(k, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        k = self._key(name, labels)
+        with self._lock:
+            h = self.hists.get(k)
+            if h is None:
+                h = self.hists[k] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0,
+                                     "recent": deque(maxlen=METRICS_SAMPLES)}
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if seconds <= le:
+                    h["buckets"][i] += 1
+                    break
+            h["sum"] += seconds
+            h["count"] += 1
+            h["recent"].append(seconds)
+
+    def gauge(self, name: str, fn):
+        """fn() -> number ya {labels-tuple: number}."""
+        self.gauges[name] = fn
+
+    def summary(self, name: str) -> dict:
+        """labels -> (count, p50, p99) recent samples se."""
+        out = {}
+        with self._lock:
+            items = [(k[1], h["count"], sorted(h["recent"])) for k, h in self.hists.items() if k[0] == name]
+        for labels, count, recent in items:
+            if recent:
+                q = lambda p: recent[min(len(recent) - 1, int(p * len(recent)))]
+                out[labels] = (count, q(0.50), q(0.99))
+        return out
+
+    def counter_values(self, name: str) -> dict:
+        with self._lock:
+            return {k[1]: v for k, v in self.counters.items() if k[0] == name}
+
+    @staticmethod
+    def _fmt_labels(labels, extra=()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            hists = sorted((k, dict(h, buckets=list(h["buckets"]))) for k, h in self.hists.items())
+        seen = set()
+        for (name, labels), v in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._fmt_labels(labels)} {v:g}")
+        for (name, labels), h in hists:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cum = 0
+            for le, n in zip(LATENCY_BUCKETS, h["buckets"]):
+                cum += n
+                lines.append(f"{name}_bucket{self._fmt_labels(labels, [('le', le)])} {cum}")
+            lines.append(f"{name}_bucket{self._fmt_labels(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{name}_sum{self._fmt_labels(labels)} {h['sum']:.6f}")
+            lines.append(f"{name}_count{self._fmt_labels(labels)} {h['count']}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                val = fn()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(val, dict):
+                for labels, v in val.items():
+                    lines.append(f"{name}{self._fmt_labels(labels)} {v:g}")
+            else:
+                lines.append(f"{name} {val:g}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def timed(callback, stage: str = None):
+    """Handler wrapper: bot_handler_seconds{handler}, bot_stage_seconds{stage} + errors."""
+    name = getattr(callback, "__name__", "callback")
+    if name == "<lambda>":
+        name = "lambda"
+    async def wrapper(update, context):
+        t = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            took = time.perf_counter() - t
+            metrics.observe("bot_handler_seconds", took, handler=name)
+            if stage:
+                metrics.observe("bot_stage_seconds", took, stage=stage)
+    wrapper.__name__ = name
+    return wrapper
+
+class MeteredRateLimiter(AIORateLimiter):
+    """AIORateLimiter + per-method API counts/errors/latency aur limiter wait time."""
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        queued = time.perf_counter()
+        started = None
+
+        async def call(*a, **kw):
+            nonlocal started
+            started = time.perf_counter()
+            metrics.observe("bot_ratelimiter_wait_seconds", started - queued)
+            return await callback(*a, **kw)
+
+        metrics.inc("bot_api_requests_total", method=endpoint)
+        try:
+            return await super().process_request(call, args, kwargs, endpoint, data, rate_limit_args)
+        except Exception as e:
+            metrics.inc("bot_api_errors_total", method=endpoint, error=type(e).__name__)
+            raise
+        finally:
+            if started is not None:
+                metrics.observe("bot_api_seconds", time.perf_counter() - started, method=endpoint)
+
+class MongoMetrics(monitoring.CommandListener):
+    """pymongo command monitoring -> bot_mongo_seconds{collection,op}."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        name = event.command_name
+        coll = event.command.get("collection") if name == "getMore" else event.command.get(name)
+        self._pending[(event.connection_id, event.request_id)] = (coll if isinstance(coll, str) else "", name)
+
+    def _done(self, event, failed: bool):
+        coll, op = self._pending.pop((event.connection_id, event.request_id), ("", event.command_name))
+        if failed:
+            metrics.inc("bot_mongo_errors_total", collection=coll, op=op)
+        metrics.observe("bot_mongo_seconds", event.duration_micros / 1e6, collection=coll, op=op)
+
+    def succeeded(self, event):
+        self._done(event, False)
+
+    def failed(self, event):
+        self._done(event, True)
+
 # ===================== DB SETUP =====================
-mongo = AsyncIOMotorClient(MONGO_URI)
-db = mongo[DB_NAME]
-chats_col = db[COL_CHATS]
-admins_col = db[COL_ADMINS]
-bclogs_col = db[COL_BCAST_LOGS]
-settings_col = db[COL_SETTINGS]
+# Import par kuch connect nahi hota: on_startup() event loop ke andar init_mongo()
+# call karta hai (shard processes me bhi apna client, fork/spawn ke baad).
+mongo = None
+db = None
+chats_col = admins_col = bclogs_col = settings_col = None
+bcjobs_col = deliveries_col = schedules_col = None
+
+def init_mongo():
+    global mongo, db, chats_col, admins_col, bclogs_col, settings_col, bcjobs_col, deliveries_col, schedules_col
+    if mongo is not None:
+        return
+    mongo = AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_POOL_MAX,
+        minPoolSize=min(MONGO_POOL_MIN, MONGO_POOL_MAX),
+        connectTimeoutMS=MONGO_CONNECT_MS,
+        serverSelectionTimeoutMS=MONGO_SELECT_MS,
+        socketTimeoutMS=MONGO_SOCKET_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_MS,
+        retryWrites=True,
+        appname=f"broadcast-bot:{INSTANCE_ID}",
+        event_listeners=[MongoMetrics()],
+    )
+    db = mongo[DB_NAME]
+    chats_col = db[COL_CHATS]
+    admins_col = db[COL_ADMINS]
+    bclogs_col = db[COL_BCAST_LOGS]
+    settings_col = db[COL_SETTINGS]
+    bcjobs_col = db[COL_BCAST_JOBS]
+    deliveries_col = db[COL_BCAST_DELIV]
+    schedules_col = db[COL_SCHEDULES]
+
+async def mongo_health_check():
+    """ping (server selection + pool checkout); fail ho to backoff ke saath retry, phir raise."""
+    for attempt in range(1, MONGO_STARTUP_TRIES + 1):
+        try:
+            t = time.perf_counter()
+            await db.command("ping")
+            return time.perf_counter() - t
+        except Exception as e:
+            if attempt == MONGO_STARTUP_TRIES:
+                raise RuntimeError(f"MongoDB not reachable: {e}") from e
+            await asyncio.sleep(2 ** attempt)
 
 # ===================== HELPERS =====================
 def is_owner(user_id: int) -> bool:
     return user_id == OWNER_ID
 
-async def is_admin(user_id: int) -> bool:
-    if is_owner(user_id):
-        return True
-    doc = await admins_col.find_one({"_id": user_id})
-    return doc is not None
+# Admin ids memory me; har command / button tap par DB hit nahi.
+# add/del turant update karte hain, doosre instances watcher se sync hote hain.
+_admin_ids = set()
+
+def is_admin(user_id: int) -> bool:
+    return is_owner(user_id) or user_id in _admin_ids
+
+async def refresh_admins() -> set:
+    """Reload admin ids from DB into the cache."""
+    global _admin_ids
+    _admin_ids = {doc["_id"] async for doc in admins_col.find({}, {"_id": 1})}
+    return _admin_ids
+
+async def watch_admins():
+    """Admin set ko sync rakho (change stream, warna TTL polling)."""
+    while True:
+        try:
+            async with admins_col.watch() as stream:
+                await refresh_admins()
+                async for change in stream:
+                    uid = change.get("documentKey", {}).get("_id")
+                    if change["operationType"] == "delete":
+                        _admin_ids.discard(uid)
+                    elif uid is not None:
+                        _admin_ids.add(uid)
+                    else:
+                        await refresh_admins()
+        except OperationFailure:
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(ADMIN_CACHE_TTL)
+
+    while True:
+        await asyncio.sleep(ADMIN_CACHE_TTL)
+        try:
+            await refresh_admins()
+        except Exception:
+            pass
 
 def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -80,32 +457,218 @@ def fmt_chat(chat_doc) -> str:
     blocked = "🚫" if chat_doc.get("blocked", False) else "✅"
     return f"{blocked} `{chat_doc['_id']}` • *{ctype}* • {title}"
 
-async def upsert_chat(chat: Chat):
-    doc = {
-        "_id": chat.id,
-        "type": chat.type,
-        "title": chat.title if chat.title else chat.username,
-        "username": chat.username,
-        "blocked": False,
-        "updated_at": now_iso(),
-        "joined_at": now_iso(),
+def _chat_state(chat: Chat) -> tuple:
+    return (chat.type, chat.title if chat.title else chat.username, chat.username)
+
+def _chat_upsert_op(state: tuple, ts: str) -> dict:
+    ctype, title, username = state
+    return {
+        "$setOnInsert": {"blocked": False, "joined_at": ts},
+        "$set": {"type": ctype, "title": title, "username": username, "updated_at": ts},
     }
-    await chats_col.update_one(
-        {"_id": chat.id},
-        {
-            "$setOnInsert": doc,
-            "$set": {
-                "type": chat.type,
-                "title": doc["title"],
-                "username": chat.username,
-                "updated_at": now_iso(),
-            },
-        },
+
+async def upsert_chat(chat: Chat):
+    state = _chat_state(chat)
+    op = _chat_upsert_op(state, now_iso())
+    # bot dobara add hua -> pehle prune/leave hua ho to wapas target me
+    op["$unset"] = {"left_at": "", "left_reason": ""}
+    before = await chats_col.find_one_and_update(
+        {"_id": chat.id}, op, upsert=True, return_document=ReturnDocument.BEFORE
+    )
+    after = dict(before or {"blocked": False}, type=state[0])
+    after.pop("left_at", None)
+    await bump_chat_counters(before, after)
+    chat_registry.remember(chat.id, state)
+
+class ChatRegistry:
+    """Known chats + last-seen title/username; only real changes hit Mongo, in bulk."""
+
+    def __init__(self):
+        self._known = {}   # chat_id -> state (insertion order = age, for eviction)
+        self._dirty = {}   # chat_id -> state, pending flush
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.stats = {"seen": 0, "changed": 0, "flushes": 0, "written": 0}
+
+    def remember(self, chat_id: int, state: tuple):
+        self._known.pop(chat_id, None)
+        self._known[chat_id] = state
+        if len(self._known) > CHAT_REGISTRY_MAX:
+            self._known.pop(next(iter(self._known)))
+
+    def note(self, chat: Chat):
+        """Hot path: pure dict lookup; changed chats are queued for the next flush."""
+        self.stats["seen"] += 1
+        state = _chat_state(chat)
+        if self._known.get(chat.id) == state:
+            return
+        self.remember(chat.id, state)
+        self._dirty[chat.id] = state
+        self.stats["changed"] += 1
+        if len(self._dirty) >= CHAT_FLUSH_MAX:
+            self._wake.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            ts = now_iso()
+            ops = [UpdateOne({"_id": cid}, _chat_upsert_op(st, ts), upsert=True) for cid, st in batch.items()]
+            try:
+                res = await chats_col.bulk_write(ops, ordered=False)
+            except Exception:
+                # agle flush me dobara try; beech me aaya naya state override na ho
+                for cid, st in batch.items():
+                    self._dirty.setdefault(cid, st)
+                raise
+            # sirf naye insert hue chats counters badalte hain
+            states = list(batch.values())
+            new_docs = [{"type": states[i][0]} for i in res.upserted_ids]
+            if new_docs:
+                await bump_chat_counters(None, None, plus=new_docs)
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(ops)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), CHAT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+chat_registry = ChatRegistry()
+
+def iso_ago(seconds: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+async def ensure_indexes():
+    await chats_col.create_index([("left_at", ASCENDING), ("blocked", ASCENDING), ("type", ASCENDING)])
+    # segment keyset scans: type=... aur joined_after/before
+    await chats_col.create_index([("type", ASCENDING), ("_id", ASCENDING)])
+    await chats_col.create_index([("joined_at", ASCENDING)])
+    # refresh_react_all_chats: sirf custom policy wale chats index me, baaki registry bahar
+    await chats_col.create_index([("reaction.mode", ASCENDING)],
+                                 partialFilterExpression={"reaction.mode": {"$exists": True}})
+    await bclogs_col.create_index([("created_at", DESCENDING)])
+    await bcjobs_col.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    await bcjobs_col.create_index([("bid", ASCENDING)])
+    await deliveries_col.create_index([("job_id", ASCENDING), ("chat_id", ASCENDING)], unique=True)
+    await deliveries_col.create_index([("job_id", ASCENDING), ("status", ASCENDING), ("chat_id", ASCENDING)])
+    await deliveries_col.create_index([("at", ASCENDING)], expireAfterSeconds=DELIV_TTL_DAYS * 86400)
+    await schedules_col.create_index([("status", ASCENDING), ("next_run", ASCENDING)])
+
+# ===================== CHAT COUNTERS =====================
+# /stats ke liye materialised counters (settings_col "chat_counters").
+# Har write path apne before/after doc ka diff $inc karta hai. Full rebuild
+# (poore registry ka aggregation, COLLSCAN) sirf tab: counters doc pehli baar
+# ban raha ho (ek hi instance claim karta hai), import ke baad, ya owner
+# `/stats rebuild` chalaye. Rebuild ka $set us dauran ke $inc overwrite karta hai,
+# isliye har startup par nahi.
+COUNTERS_ID = "chat_counters"
+
+def _counter_contrib(doc) -> dict:
+    if not doc or doc.get("left_at"):
+        return {}
+    c = {"total": 1}
+    if doc.get("type") in ("group", "supergroup"):
+        c["groups"] = 1
+    elif doc.get("type") == "channel":
+        c["channels"] = 1
+    if doc.get("blocked"):
+        c["blocked"] = 1
+    return c
+
+async def bump_chat_counters(before, after, plus=(), minus=()):
+    inc = {}
+    for docs, sign in (([after], 1), ([before], -1), (plus, 1), (minus, -1)):
+        for d in docs:
+            for k, v in _counter_contrib(d).items():
+                inc[k] = inc.get(k, 0) + sign * v
+    inc = {k: v for k, v in inc.items() if v}
+    if inc:
+        await settings_col.update_one({"_id": COUNTERS_ID}, {"$inc": inc}, upsert=True)
+
+async def rebuild_chat_counters():
+    pipeline = [
+        {"$match": {"left_at": {"$exists": False}}},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "groups": {"$sum": {"$cond": [{"$in": ["$type", ["group", "supergroup"]]}, 1, 0]}},
+            "channels": {"$sum": {"$cond": [{"$eq": ["$type", "channel"]}, 1, 0]}},
+            "blocked": {"$sum": {"$cond": [{"$eq": ["$blocked", True]}, 1, 0]}},
+        }},
+    ]
+    rows = await chats_col.aggregate(pipeline).to_list(1)
+    c = rows[0] if rows else {}
+    await settings_col.update_one(
+        {"_id": COUNTERS_ID},
+        {"$set": {**{k: c.get(k, 0) for k in ("total", "groups", "channels", "blocked")},
+                  "built_at": now_iso()}},
         upsert=True,
     )
 
+async def ensure_chat_counters():
+    """Startup: counters kabhi build nahi hue to ek instance rebuild kare, baaki skip."""
+    try:
+        # built_at wala doc ho to upsert duplicate _id par fail -> koi aur bana chuka
+        await settings_col.update_one(
+            {"_id": COUNTERS_ID, "built_at": {"$exists": False}},
+            {"$set": {"built_at": now_iso()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return
+    await rebuild_chat_counters()
+
+async def get_chat_counters() -> dict:
+    return await settings_col.find_one({"_id": COUNTERS_ID}) or {}
+
 async def mark_left(chat_id: int):
-    await chats_col.update_one({"_id": chat_id}, {"$set": {"left_at": now_iso()}})
+    before = await chats_col.find_one_and_update(
+        {"_id": chat_id, "left_at": {"$exists": False}},
+        {"$set": {"left_at": now_iso()}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    await bump_chat_counters(before, None)
+
+async def set_chat_blocked(chat_id: int, blocked: bool):
+    before = await chats_col.find_one_and_update(
+        {"_id": chat_id}, {"$set": {"blocked": blocked}}, return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        await bump_chat_counters(before, dict(before, blocked=blocked))
+
+async def prune_chats(chat_ids: list, reason: str):
+    """Bulk-mark chats we can no longer deliver to (kicked, deleted, ...)."""
+    q = {"_id": {"$in": chat_ids}, "left_at": {"$exists": False}}
+    docs = await chats_col.find(q, {"type": 1, "blocked": 1}).to_list(None)
+    await chats_col.update_many(q, {"$set": {"left_at": now_iso(), "left_reason": reason}})
+    await bump_chat_counters(None, None, minus=docs)
+
+async def migrate_chat(old_id: int, new_id: int):
+    """Group -> supergroup: move the chat doc to its new id and retire the old one."""
+    old = await chats_col.find_one({"_id": old_id}) or {}
+    ts = now_iso()
+    fields = {k: v for k, v in old.items() if k not in ("_id", "left_at", "left_reason")}
+    fields.update(type=ChatType.SUPERGROUP, updated_at=ts, migrated_from=old_id)
+    fields.setdefault("blocked", False)
+    fields.setdefault("joined_at", ts)
+    res = await chats_col.update_one({"_id": new_id}, {"$setOnInsert": fields}, upsert=True)
+    retired = await chats_col.find_one_and_update(
+        {"_id": old_id, "left_at": {"$exists": False}},
+        {"$set": {"left_at": ts, "left_reason": "migrated", "migrated_to": new_id}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    await bump_chat_counters(retired, fields if res.upserted_id is not None else None)
 
 # ===================== UI MARKUPS =====================
 
@@ -184,7 +747,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=owner_menu_kb()
         )
-    elif await is_admin(user_id):
+    elif is_admin(user_id):
         await update.effective_message.reply_text(
             "🛡️ 𝗔𝗱𝗺𝗶𝗻 𝗣𝗮𝗻𝗲𝗹 🛡️\n"
             "📢 You can broadcast & view stats.",
@@ -209,7 +772,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, role:
     if role is None:
         if is_owner(user_id):
             role = "owner"
-        elif await is_admin(user_id):
+        elif is_admin(user_id):
             role = "admin"
         else:
             role = "user"
@@ -217,24 +780,34 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, role:
     if role == "owner":
         text = (
             "👑 *Owner Commands*\n"
-            "📣 `/broadcast` - Send a broadcast\n"
-            "📊 `/stats` - View bot stats\n"
-            "📜 `/list` - List all chats\n"
+            "📣 `/broadcast [type=channel] [joined_after=7d] [preview]` - Send a broadcast\n"
+            "🔁 `/retryfailed <broadcast_id>` - Resend to chats that failed\n"
+            "⏰ `/schedule <when> [every=1d] [window=2h]` - Schedule a broadcast\n"
+            "🗓 `/schedules` • `/unschedule <id>` - List / cancel schedules\n"
+            "📊 `/stats [rebuild]` - View bot stats (rebuild = recount chats)\n"
+            "📜 `/list [chat_id]` - List all chats (optionally from a chat id)\n"
             "🚫 `/block <chat_id>` - Block a chat\n"
             "✅ `/unblock <chat_id>` - Unblock a chat\n"
             "➕ `/addadmin <id>` - Add admin\n"
             "➖ `/deladmin <id>` - Remove admin\n"
             "👥 `/admins` - List admins\n"
             "🏳 `/leave <chat_id>` - Leave a chat\n"
+            "📦 `/exportchats [csv] [active] [type=..]` - Download the chat registry\n"
+            "📥 `/importchats [new]` - Reply to an export file to load it\n"
             "😊 `/addreaction <emoji>` - Add emoji to reaction list\n"
             "🗑 `/delreaction <emoji>` - Remove emoji from list\n"
             "🎯 `/reactions` - View current emoji list\n"
-            "🏓 `/ping` - Test bot speed"
+            "🎛 `/chatreact <chat_id> [mode=] [sample=] [big=] [emojis=]` - Per-chat reactions\n"
+            "🏓 `/ping` - Test bot speed\n"
+            "⚙️ `/perf` - Latency & throughput summary"
         )
     elif role == "admin":
         text = (
             "🛡️ *Admin Commands*\n"
-            "📣 `/broadcast` - Send a broadcast\n"
+            "📣 `/broadcast [type=channel] [joined_after=7d] [preview]` - Send a broadcast\n"
+            "🔁 `/retryfailed <broadcast_id>` - Resend to chats that failed\n"
+            "⏰ `/schedule <when> [every=1d] [window=2h]` - Schedule a broadcast\n"
+            "🗓 `/schedules` • `/unschedule <id>` - List / cancel schedules\n"
             "📊 `/stats` - View bot stats\n"
             "🏓 `/ping` - Test bot speed"
         )
@@ -270,7 +843,49 @@ async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.effective_message.reply_text("Pong...")
     end_ts = datetime.now(timezone.utc)
     delta = (end_ts - start_ts).total_seconds() * 1000
-    await msg.edit_text(f"🏓 Pong! `{int(delta)} ms`", parse_mode=ParseMode.MARKDOWN)
+    b = update_backlog(context.application)
+    await msg.edit_text(
+        f"🏓 Pong! `{int(delta)} ms`\n"
+        f"Updates: queued `{b['queued']}` • waiting `{b['waiting']}` • active `{b['active']}`",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+def _perf_rows(name: str, top: int = 8) -> list:
+    rows = sorted(metrics.summary(name).items(), key=lambda kv: -kv[1][2])[:top]
+    return [
+        f"`{'.'.join(str(v) for _, v in labels) or '-'}` {n} • {p50 * 1000:.1f} • {p99 * 1000:.1f}"
+        for labels, (n, p50, p99) in rows
+    ] or ["—"]
+
+async def perf_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id): return
+    errors = {}
+    for labels, v in metrics.counter_values("bot_api_errors_total").items():
+        l = dict(labels)
+        errors[f"{l['method']}:{l['error']}"] = int(v)
+    wait = metrics.summary("bot_ratelimiter_wait_seconds").get((), (0, 0.0, 0.0))
+    b = update_backlog(context.application)
+    rs = reaction_dispatcher.stats
+    lines = [
+        f"⚙️ *Perf* (up {fmt_duration(time.time() - metrics.started)})",
+        f"Startup: {lifecycle['startup_s']}s • Mongo ping {lifecycle['mongo_ping_ms']} ms • pool ≤{MONGO_POOL_MAX}",
+        "",
+        "*Stages* (n • p50 • p99 ms)", *_perf_rows("bot_stage_seconds"),
+        "*Handlers*", *_perf_rows("bot_handler_seconds"),
+        "*Update* (filters + blocking)", *_perf_rows("bot_update_seconds"),
+        "",
+        "*Telegram API* (n • p50 • p99 ms)", *_perf_rows("bot_api_seconds", 6),
+        "Errors: " + (", ".join(f"{k} {v}" for k, v in sorted(errors.items(), key=lambda kv: -kv[1])[:6]) or "none"),
+        f"Limiter wait: p50 {wait[1] * 1000:.1f} • p99 {wait[2] * 1000:.1f} ms",
+        "",
+        "*Mongo* (n • p50 • p99 ms)", *_perf_rows("bot_mongo_seconds", 6),
+        "",
+        f"*Broadcast*: active {len(_active_runs)} • pacer "
+        f"{sum(r.pacer.rate for r in _active_runs.values()):.1f}/s",
+        f"*Updates*: queued {b['queued']} • waiting {b['waiting']} • active {b['active']} • dropped {b['dropped']}",
+        f"*Reactions*: pending {reaction_dispatcher.depth()} • sent {rs['sent']} • dropped {rs['dropped']}",
+    ]
+    await update.effective_message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
@@ -281,6 +896,7 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await update.effective_message.reply_text("Invalid user_id."); return
     await admins_col.update_one({"_id": uid}, {"$set": {"_id": uid, "added_at": now_iso()}}, upsert=True)
+    _admin_ids.add(uid)
     await update.effective_message.reply_text(f"✅ Added admin: `{uid}`", parse_mode=ParseMode.MARKDOWN)
 
 async def del_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -292,6 +908,7 @@ async def del_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await update.effective_message.reply_text("Invalid user_id."); return
     await admins_col.delete_one({"_id": uid})
+    _admin_ids.discard(uid)
     await update.effective_message.reply_text(f"🗑️ Removed admin: `{uid}`", parse_mode=ParseMode.MARKDOWN)
 
 async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -304,17 +921,26 @@ async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    if not (is_owner(uid) or await is_admin(uid)): return
-    total = await chats_col.count_documents({"left_at": {"$exists": False}})
-    blocked = await chats_col.count_documents({"blocked": True, "left_at": {"$exists": False}})
-    groups = await chats_col.count_documents({"type": {"$in": ["group", "supergroup"]}, "left_at": {"$exists": False}})
-    channels = await chats_col.count_documents({"type": "channel", "left_at": {"$exists": False}})
-    last = await bclogs_col.find_one(sort=[("created_at", -1)])
+    if not (is_owner(uid) or is_admin(uid)): return
+    if is_owner(uid) and context.args and context.args[0].lower() == "rebuild":
+        await rebuild_chat_counters()
+    c = await get_chat_counters()
+    last = c.get("last_broadcast")
     text = [
         "📊 *Stats*",
-        f"Total chats: *{total}* (groups: *{groups}*, channels: *{channels}*)",
-        f"Blocked: *{blocked}*",
+        f"Total chats: *{c.get('total', 0)}* (groups: *{c.get('groups', 0)}*, channels: *{c.get('channels', 0)}*)",
+        f"Blocked: *{c.get('blocked', 0)}*",
     ]
+    if SHARDS > 1:
+        live = [d async for d in settings_col.find({
+            "_id": {"$regex": "^shard:"}, "at": {"$gt": iso_ago(SHARD_STATS_EVERY * 3)}
+        })]
+        text += [
+            "",
+            f"🧩 *Shards*: *{len(live)}*/{SHARDS} live",
+            f"Updates processed: *{sum(d.get('updates', 0) for d in live)}*",
+            f"Reactions sent: *{sum((d.get('reactions') or {}).get('sent', 0) for d in live)}*",
+        ]
     if last:
         text += [
             "",
@@ -330,19 +956,48 @@ PAGE_SIZE = 10
 
 async def list_chats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id): return
+    if context.args:
+        # /list <chat_id> -> us chat se page shuru
+        try:
+            start_at = int(context.args[0])
+        except ValueError:
+            await update.effective_message.reply_text("Usage: /list [chat_id]"); return
+        await send_chat_page(update.effective_chat.id, context, 0, after=start_at - 1)
+        return
     await send_chat_page(update.effective_chat.id, context, 1)
 
-async def send_chat_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int):
-    skip = (page - 1) * PAGE_SIZE
-    cursor = chats_col.find({"left_at": {"$exists": False}}).sort("_id", 1).skip(skip).limit(PAGE_SIZE)
-    items = [doc async for doc in cursor]
-    total = await chats_col.count_documents({"left_at": {"$exists": False}})
-    pages = max(1, math.ceil(total / PAGE_SIZE))
+async def send_chat_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int, after: int = None, before: int = None):
+    """Keyset pagination on _id: har page ek indexed range query, depth se farak nahi padta.
+
+    page=0 matlab jump se aaye (page number pata nahi).
+    """
+    q = {"left_at": {"$exists": False}}
+    if before is not None:
+        q["_id"] = {"$lt": before}
+        items = await chats_col.find(q).sort("_id", -1).limit(PAGE_SIZE).to_list(PAGE_SIZE)
+        items.reverse()
+        has_next = True
+    else:
+        if after is not None:
+            q["_id"] = {"$gt": after}
+        items = await chats_col.find(q).sort("_id", 1).limit(PAGE_SIZE + 1).to_list(PAGE_SIZE + 1)
+        has_next = len(items) > PAGE_SIZE
+        items = items[:PAGE_SIZE]
     if not items:
         await context.bot.send_message(chat_id, "No chats."); return
-    text = "📜 *Chats (page {}/{})*\n\n".format(page, pages) + "\n".join(fmt_chat(d) for d in items)
-    prev_btn = InlineKeyboardButton("⬅️ Prev", callback_data=f"menu:list:{page-1}") if page > 1 else InlineKeyboardButton(" ", callback_data="noop")
-    next_btn = InlineKeyboardButton("Next ➡️", callback_data=f"menu:list:{page+1}") if page < pages else InlineKeyboardButton(" ", callback_data="noop")
+    first, last = items[0]["_id"], items[-1]["_id"]
+    if page == 0:
+        has_prev = await chats_col.find_one({"left_at": {"$exists": False}, "_id": {"$lt": first}}, {"_id": 1}) is not None
+        header = f"📜 *Chats (from `{first}`)*"
+    else:
+        has_prev = page > 1
+        total = (await get_chat_counters()).get("total", 0)
+        pages = max(page, math.ceil(total / PAGE_SIZE))
+        header = "📜 *Chats (page {}/{})*".format(page, pages)
+    text = header + "\n\n" + "\n".join(fmt_chat(d) for d in items)
+    prev_page = max(page - 1, 0)
+    prev_btn = InlineKeyboardButton("⬅️ Prev", callback_data=f"menu:list:{prev_page}:b:{first}") if has_prev else InlineKeyboardButton(" ", callback_data="noop")
+    next_btn = InlineKeyboardButton("Next ➡️", callback_data=f"menu:list:{page+1 if page else 0}:a:{last}") if has_next else InlineKeyboardButton(" ", callback_data="noop")
     kb = InlineKeyboardMarkup([[prev_btn, next_btn]])
     await context.bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
 
@@ -351,7 +1006,7 @@ async def block_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.effective_message.reply_text("Usage: /block <chat_id>"); return
     cid = int(context.args[0])
-    await chats_col.update_one({"_id": cid}, {"$set": {"blocked": True}})
+    await set_chat_blocked(cid, True)
     await update.effective_message.reply_text(f"🚫 Blocked chat `{cid}`", parse_mode=ParseMode.MARKDOWN)
 
 async def unblock_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -359,7 +1014,7 @@ async def unblock_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.effective_message.reply_text("Usage: /unblock <chat_id>"); return
     cid = int(context.args[0])
-    await chats_col.update_one({"_id": cid}, {"$set": {"blocked": False}})
+    await set_chat_blocked(cid, False)
     await update.effective_message.reply_text(f"✅ Unblocked chat `{cid}`", parse_mode=ParseMode.MARKDOWN)
 
 async def leave_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -374,125 +1029,1563 @@ async def leave_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.effective_message.reply_text(f"Error leaving chat: `{e}`", parse_mode=ParseMode.MARKDOWN)
 
-# =============== BROADCAST ===============
-async def _iter_target_chats():
-    cursor = chats_col.find({"left_at": {"$exists": False}, "blocked": {"$ne": True}})
-    async for doc in cursor:
-        yield int(doc["_id"])
-
-async def do_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-    await update.effective_message.reply_text("🚀 Broadcasting text…")
-    success, failed = 0, 0
-    details = []
-    sem = asyncio.Semaphore(CONCURRENCY)
-
-    async def send_one(chat_id: int):
-        nonlocal success, failed
-        async with sem:
+# =============== CHAT EXPORT / IMPORT ===============
+# Registry backup / naye deployment me migration. Export batched cursor se gzip temp
+# file me stream hota hai (poori collection memory me nahi aati); import upload ko
+# line-by-line padhta hai aur ordered=False bulk_write batches me `_id` par upsert
+# karta hai, isliye wahi file dobara chalana safe hai.
+CHAT_FIELDS = ("_id", "type", "title", "username", "blocked", "joined_at", "updated_at",
+               "left_at", "left_reason", "migrated_from", "migrated_to", "reaction")
+CHAT_TYPES = ("private", "group", "supergroup", "channel")
+_JSON_OPTS = json_util.RELAXED_JSON_OPTIONS
+# ek galat row poora import na roke: ye sab us row ko "bad" gin kar aage badhte hain
+_BAD_ROW = (ValueError, TypeError, BSONError)
+
+def _encode_chats(docs: list, fmt: str) -> str:
+    if fmt == "jsonl":
+        return "".join(json_util.dumps({k: d[k] for k in CHAT_FIELDS if k in d}, json_options=_JSON_OPTS) + "\n"
+                       for d in docs)
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for d in docs:
+        row = []
+        for k in CHAT_FIELDS:
+            v = d.get(k)
+            if isinstance(v, dict):
+                v = json.dumps(v, ensure_ascii=False)
+            elif isinstance(v, bool):
+                v = "true" if v else "false"
+            row.append("" if v is None else v)
+        w.writerow(row)
+    return buf.getvalue()
+
+async def export_chats(path: str, fmt: str, query: dict) -> int:
+    """chats_col -> gzip JSONL/CSV file; _id order, CHAT_EXPORT_BATCH docs per write."""
+    n = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as out:
+        if fmt == "csv":
+            out.write(",".join(CHAT_FIELDS) + "\r\n")
+        cursor = chats_col.find(query, {k: 1 for k in CHAT_FIELDS}).sort("_id", 1).batch_size(CHAT_EXPORT_BATCH)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= CHAT_EXPORT_BATCH:
+                # compression thread me, event loop free rahe
+                await asyncio.to_thread(out.write, _encode_chats(batch, fmt))
+                n += len(batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(out.write, _encode_chats(batch, fmt))
+            n += len(batch)
+    return n
+
+def _csv_doc(row: dict) -> dict:
+    doc = {}
+    for k, v in row.items():
+        if k not in CHAT_FIELDS or v is None or v == "":
+            continue
+        if k in ("_id", "migrated_from", "migrated_to"):
+            v = int(v)
+        elif k == "blocked":
+            v = v.strip().lower() in ("true", "1", "yes")
+        elif k == "reaction":
+            v = json.loads(v)
+        doc[k] = v
+    return doc
+
+def _csv_lines(f):
+    """Binary lines -> text. Galat UTF-8 bytes surrogateescape se aage jate hain aur
+    _import_op ke bson_encode par woh row bad ho jati hai (file beech me nahi tootti)."""
+    for n, raw in enumerate(f):
+        line = raw.decode("utf-8", "surrogateescape")
+        yield line.removeprefix("\ufeff") if n == 0 else line
+
+def _iter_import(path: str, fmt: str):
+    """(line_no, doc ya None) yield karta hai; gzip ho ya plain, dono chalte hain."""
+    with open(path, "rb") as f:
+        packed = f.read(2) == b"\x1f\x8b"
+    opener = gzip.open if packed else open
+    with opener(path, "rb") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(_csv_lines(f))
+            for i in itertools.count(2):
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error:
+                    yield i, None
+                    continue
+                try:
+                    doc = _csv_doc(row)
+                except _BAD_ROW:
+                    doc = None
+                yield i, doc
+        for i, raw in enumerate(f, 1):
             try:
-                await context.bot.send_message(chat_id, text, disable_web_page_preview=True)
-                success += 1
-                details.append({"chat_id": chat_id, "ok": True})
-            except Exception as e:
-                failed += 1
-                details.append({"chat_id": chat_id, "ok": False, "error": str(e)})
-
-    i = 0
-    tasks = []
-    async for cid in _iter_target_chats():
-        tasks.append(asyncio.create_task(send_one(cid)))
-        i += 1
-        if i % SLEEP_EVERY == 0:
-            await asyncio.sleep(SLEEP_TIME)
-    await asyncio.gather(*tasks)
-
-    log = {"mode": "text", "created_at": now_iso(), "success": success, "failed": failed, "details": details[-50:]}
-    await bclogs_col.insert_one(log)
-    await update.effective_message.reply_text(f"✅ Done. Sent: *{success}*, Failed: *{failed}*", parse_mode=ParseMode.MARKDOWN)
+                line = raw.decode("utf-8-sig" if i == 1 else "utf-8").strip()
+                if not line:
+                    continue
+                doc = json_util.loads(line, json_options=_JSON_OPTS)
+            except _BAD_ROW:
+                doc = None
+            yield i, doc
+
+def _import_op(doc, only_new: bool, ts: str):
+    """Validated upsert on _id; galat row par None. only_new = existing chats ko mat chhuo."""
+    if not isinstance(doc, dict):
+        return None
+    cid = doc.get("_id")
+    if isinstance(cid, bool) or not isinstance(cid, int) or cid == 0:
+        return None
+    fields = {k: doc[k] for k in CHAT_FIELDS[1:] if doc.get(k) is not None}
+    if fields.get("type") not in CHAT_TYPES:
+        return None
+    if not isinstance(fields.get("reaction", {}), dict):
+        return None
+    if "blocked" in fields:
+        fields["blocked"] = bool(fields["blocked"])
+    try:
+        bson_encode(fields)   # lone surrogates (galat bytes), na-encode hone wale types
+    except _BAD_ROW:
+        return None
+    defaults = {k: v for k, v in (("blocked", False), ("joined_at", ts)) if k not in fields}
+    if only_new:
+        return UpdateOne({"_id": cid}, {"$setOnInsert": {**defaults, **fields}}, upsert=True)
+    op = {"$set": fields}
+    if defaults:
+        op["$setOnInsert"] = defaults
+    return UpdateOne({"_id": cid}, op, upsert=True)
+
+async def import_chats(path: str, fmt: str, only_new: bool = False, progress=None) -> dict:
+    stats = {"rows": 0, "bad": 0, "inserted": 0, "updated": 0, "unchanged": 0, "errors": 0}
+    rows = _iter_import(path, fmt)
+    ts = now_iso()
+    try:
+        while True:
+            # file parse thread me, ek batch at a time
+            chunk = await asyncio.to_thread(list, itertools.islice(rows, CHAT_IMPORT_BATCH))
+            if not chunk:
+                break
+            stats["rows"] += len(chunk)
+            ops = []
+            for _, doc in chunk:
+                op = _import_op(doc, only_new, ts)
+                if op is None:
+                    stats["bad"] += 1
+                else:
+                    ops.append(op)
+            if not ops:
+                continue
+            try:
+                res = (await chats_col.bulk_write(ops, ordered=False)).bulk_api_result
+            except BulkWriteError as e:
+                # ordered=False: baaki ops lag chuke hain, sirf galat wale gino
+                res = e.details
+                stats["errors"] += len(res.get("writeErrors", []))
+            stats["inserted"] += res.get("nUpserted", 0)
+            stats["updated"] += res.get("nModified", 0)
+            stats["unchanged"] += res.get("nMatched", 0) - res.get("nModified", 0)
+            if progress:
+                await progress(stats)
+    finally:
+        rows.close()
+    return stats
+
+async def exportchats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id): return
+    msg = update.effective_message
+    args = list(context.args)
+    fmt = args.pop(0).lower() if args and args[0].lower() in ("csv", "jsonl") else "jsonl"
+    active = bool(args) and args[0].lower() == "active"
+    if active:
+        args.pop(0)
+    try:
+        spec, rest = parse_segment(args)
+    except ValueError as e:
+        await msg.reply_text(str(e)); return
+    if rest:
+        await msg.reply_text("Usage: /exportchats [csv] [active] [type=channel] [joined_after=7d]"); return
+    query = segment_query(spec)
+    if active:
+        query = _target_query(query)
+    status = await msg.reply_text("📦 Exporting chats…")
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        t = time.perf_counter()
+        n = await export_chats(path, fmt, query)
+        size = os.path.getsize(path)
+        if size > CHAT_EXPORT_MAX_BYTES:
+            await status.edit_text(f"Export is {size / 1048576:.1f} MB (limit 50 MB). Narrow it with type=/joined_after=.")
+            return
+        what = describe_segment(spec) + (", active only" if active else "")
+        with open(path, "rb") as f:
+            await context.bot.send_document(
+                msg.chat_id, f,
+                filename=f"chats-{datetime.now(timezone.utc):%Y%m%d-%H%M}.{fmt}.gz",
+                caption=f"📦 {n} chats ({what}) • {size / 1024:.0f} KB • {time.perf_counter() - t:.1f}s",
+                reply_to_message_id=msg.message_id,
+                write_timeout=120,
+            )
+        await status.delete()
+    except Exception as e:
+        await status.edit_text(f"Export failed: {e}")
+    finally:
+        os.unlink(path)
+
+async def importchats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id): return
+    msg = update.effective_message
+    src = msg.reply_to_message.document if msg.reply_to_message else None
+    if not src:
+        await msg.reply_text(
+            "Reply to a `.jsonl(.gz)` or `.csv(.gz)` file (e.g. from /exportchats) with `/importchats`.\n"
+            "`/importchats new` - only add chats that don't exist yet",
+            parse_mode=ParseMode.MARKDOWN,
+        ); return
+    if src.file_size and src.file_size > CHAT_IMPORT_MAX_BYTES:
+        await msg.reply_text("File too big: bots can download up to 20 MB. Gzip it or split it."); return
+    only_new = bool(context.args) and context.args[0].lower() == "new"
+    name = src.file_name or "upload"
+    fmt = "csv" if ".csv" in name.lower() else "jsonl"
+    status = await msg.reply_text("📥 Importing…")
+    fd, path = tempfile.mkstemp(suffix=".import")
+    os.close(fd)
+    last = [time.monotonic()]
+
+    async def progress(st):
+        if time.monotonic() - last[0] < CHAT_IMPORT_PROGRESS:
+            return
+        last[0] = time.monotonic()
+        try:
+            await status.edit_text(f"📥 Importing… {st['rows']} rows")
+        except Exception:
+            pass
+
+    try:
+        t = time.perf_counter()
+        await (await src.get_file()).download_to_drive(path)
+        st = await import_chats(path, fmt, only_new, progress)
+        # counters / caches naye docs ke hisaab se
+        await rebuild_chat_counters()
+        await refresh_react_all_chats()
+        reaction_policies.clear()
+        await status.edit_text(
+            f"📥 Imported `{name}` in {time.perf_counter() - t:.1f}s\n"
+            f"Rows: *{st['rows']}* • New: *{st['inserted']}* • Updated: *{st['updated']}* • "
+            f"Unchanged: *{st['unchanged']}*\nSkipped (bad rows): *{st['bad']}* • Write errors: *{st['errors']}*",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+    except Exception as e:
+        await status.edit_text(f"Import failed: {e}")
+    finally:
+        os.unlink(path)
 
-async def do_broadcast_copy(update: Update, context: ContextTypes.DEFAULT_TYPE, src_msg):
-    await update.effective_message.reply_text("🚀 Broadcasting message copy…")
-    success, failed = 0, 0
-    details = []
-    sem = asyncio.Semaphore(CONCURRENCY)
+# =============== BROADCAST ===============
+# /broadcast sirf job enqueue karta hai. Har job ek Mongo document hai jisme
+# checkpoint (`cursor` = chat _id jiske tak sab ho chuka) aur counters hain;
+# per-chat result broadcast_deliveries me stream hota hai. Worker crash/restart ke
+# baad cursor se resume karta hai aur jinko pehle bhej chuka unhe skip karta hai.
+_bcast_wake = asyncio.Event()
+_draining = False   # shutdown: naye jobs claim nahi hote, chal rahe suspend hote hain
+
+def shard_for(chat_id: int) -> int:
+    return abs(chat_id) % SHARDS
+
+def shard_filter(shard: int, shards: int, field: str = "_id") -> dict:
+    """Chats owned by `shard`. Mongo ka $mod truncated remainder deta hai (-7 mod 3 = -1)."""
+    if shards <= 1:
+        return {}
+    return {"$or": [{field: {"$mod": [shards, shard]}}, {field: {"$mod": [shards, -shard]}}]}
+
+def _parts_query(bid) -> dict:
+    # bid se pehle wale jobs ka bid unka apna _id hai
+    return {"$or": [{"bid": bid}, {"_id": bid}]}
+
+def _target_query(extra: dict = None) -> dict:
+    return {"left_at": {"$exists": False}, "blocked": {"$ne": True}, **(extra or {})}
+
+# /retryfailed inhe dobara bhejta hai; dead (pruned) aur migrated nahi
+RETRY_REASONS = ("flood", "transient", "bad_request", "error", "no_rights")
+
+def _retry_query(bid, extra: dict = None) -> dict:
+    return {"job_id": bid, "status": {"$in": list(RETRY_REASONS)}, **(extra or {})}
+
+async def _next_retry_batch(bid, after, limit: int, extra: dict = None) -> list:
+    """Ledger se failed chat ids (keyset on chat_id); chats collection scan nahi hota."""
+    q = _retry_query(bid, extra)
+    if after is not None:
+        q["chat_id"] = {"$gt": after}
+    cursor = deliveries_col.find(q, {"chat_id": 1, "_id": 0}).sort("chat_id", 1).limit(limit)
+    return [doc["chat_id"] async for doc in cursor]
+
+async def _still_targetable(ids: list) -> list:
+    # beech me left/blocked hue chats chhod do (point lookups by _id)
+    live = set(await chats_col.distinct("_id", _target_query({"_id": {"$in": ids}})))
+    return [cid for cid in ids if cid in live]
+
+# Audience segments: /broadcast type=channel joined_after=7d ...
+# Job par plain spec save hota hai (Mongo operators nahi), query runtime par banti hai.
+SEGMENT_KEYS = ("type", "joined_after", "joined_before")
+SEGMENT_TYPES = {
+    "private": ["private"], "group": ["group"], "supergroup": ["supergroup"],
+    "groups": ["group", "supergroup"], "channel": ["channel"],
+}
+
+def _segment_date(value: str) -> str:
+    # `7d` = pichhle 7 din, warna date/datetime (SCHEDULE_TZ)
+    try:
+        at = datetime.now(timezone.utc) - timedelta(seconds=parse_duration(value))
+    except ValueError:
+        at = datetime.fromisoformat(value)
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=SCHEDULE_TZ)
+    # joined_at ISO string hai; same format me compare
+    return at.astimezone(timezone.utc).isoformat()
+
+def parse_segment(args: list):
+    """Leading `key=value` segment tokens -> (spec, remaining args). Bad value par ValueError."""
+    spec = {}
+    while args and args[0].split("=", 1)[0] in SEGMENT_KEYS and "=" in args[0]:
+        key, value = args.pop(0).split("=", 1)
+        if key == "type":
+            types = []
+            for t in value.lower().split(","):
+                if t not in SEGMENT_TYPES:
+                    raise ValueError(f"Unknown type '{t}'. Use: {', '.join(SEGMENT_TYPES)}")
+                types += SEGMENT_TYPES[t]
+            spec["types"] = sorted(set(types))
+        else:
+            try:
+                spec[key] = _segment_date(value)
+            except ValueError:
+                raise ValueError(f"Bad date for {key}: use 2026-01-31 or 7d")
+    return spec, args
+
+def segment_query(spec: dict) -> dict:
+    q = {}
+    if spec.get("types"):
+        q["type"] = {"$in": spec["types"]}
+    joined = {}
+    if spec.get("joined_after"):
+        joined["$gt"] = spec["joined_after"]
+    if spec.get("joined_before"):
+        joined["$lt"] = spec["joined_before"]
+    if joined:
+        q["joined_at"] = joined
+    return q
+
+def describe_segment(spec: dict) -> str:
+    if not spec:
+        return "all chats"
+    parts = []
+    if spec.get("types"):
+        parts.append("type " + "/".join(spec["types"]))
+    if spec.get("joined_after"):
+        parts.append("joined after " + spec["joined_after"][:16].replace("T", " "))
+    if spec.get("joined_before"):
+        parts.append("joined before " + spec["joined_before"][:16].replace("T", " "))
+    return ", ".join(parts)
+
+async def count_targets(spec: dict) -> int:
+    return await chats_col.count_documents(_target_query(segment_query(spec)))
+
+async def _next_target_batch(after, limit: int, extra: dict = None) -> list:
+    q = _target_query(extra)
+    if after is not None:
+        q["_id"] = {"$gt": after}
+    cursor = chats_col.find(q, {"_id": 1}).sort("_id", 1).limit(limit)
+    return [int(doc["_id"]) async for doc in cursor]
+
+async def enqueue_broadcast(mode: str, created_by: int, notify_chat_id: int, *,
+                            bid: ObjectId = None, status: str = "queued", **payload) -> ObjectId:
+    """Insert one job part per shard; returns the broadcast id (`bid`) shared by all parts.
+
+    status="scheduled" parts worker claim nahi karta (pre-warmed schedule), jab tak
+    fire time par "queued" na ho.
+    """
+    bid = bid or ObjectId()
+    job = {
+        "bid": bid,
+        "shards": SHARDS,
+        "mode": mode,
+        "status": status,
+        "created_at": now_iso(),
+        "created_by": created_by,
+        "notify_chat_id": notify_chat_id,
+        "cursor": None,
+        "success": 0,
+        "failed": 0,
+        "attempts": 0,
+        **payload,
+    }
+    parts = []
+    retry_of = payload.get("retry_of")
+    for k in range(SHARDS):
+        # total sirf progress/ETA ke liye; resume par fixed rehta hai
+        if retry_of is not None:
+            total = await deliveries_col.count_documents(_retry_query(retry_of, shard_filter(k, SHARDS, "chat_id")))
+        else:
+            total = await chats_col.count_documents(
+                _target_query({**segment_query(payload.get("segment") or {}), **shard_filter(k, SHARDS)})
+            )
+        parts.append(dict(job, shard=k, total=total))
+    await bcjobs_col.insert_many(parts)
+    if status == "queued":
+        _bcast_wake.set()
+    return bid
+
+async def claim_broadcast_job():
+    """Atomically pick the oldest queued job, or a running one whose worker died."""
+    shard = SHARD_INDEX or 0
+    return await bcjobs_col.find_one_and_update(
+        {"shard": shard if shard else {"$in": [0, None]}, "$or": [
+            # error retry: backoff (not_before) khatam hone tak nahi
+            {"status": "queued", "not_before": {"$not": {"$gt": now_iso()}}},
+            # fresh heartbeat = koi process abhi bhej raha/drain kar raha hai -> double-send nahi
+            {"status": "running", "heartbeat_at": {"$lt": iso_ago(BCAST_STALE_AFTER)}},
+        ]},
+        {"$set": {"status": "running", "worker": INSTANCE_ID, "heartbeat_at": now_iso()},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
 
-    async def copy_one(chat_id: int):
-        nonlocal success, failed
-        async with sem:
+async def _send_broadcast(bot, job, chat_id: int):
+    if job["mode"] == "text":
+        await bot.send_message(chat_id, job["text"], disable_web_page_preview=True)
+    elif job["mode"] == "copies":
+        # album / multi-part: poori list ek API call (aur ek pacer token) me
+        await bot.copy_messages(chat_id, job["from_chat_id"], job["message_ids"])
+    else:
+        await bot.copy_message(chat_id, job["from_chat_id"], job["message_id"])
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+
+# Failure classes (ledger `status`). forbidden/not_found = dead chat -> prune.
+# no_rights (bot member hai par post nahi kar sakta) prune nahi hota, /retryfailed se dobara.
+DEAD_REASONS = ("forbidden", "not_found")
+
+def _is_no_rights(message: str) -> bool:
+    # bot chat me hai, bas post karne ki permission nahi (e.g. channel admin bina "Post")
+    m = message.lower()
+    return "chat_write_forbidden" in m or "not enough rights" in m or "have no rights" in m
+
+def classify_error(e: Exception) -> str:
+    if isinstance(e, RetryAfter):
+        return "flood"
+    if isinstance(e, ChatMigrated):
+        return "migrated"
+    if isinstance(e, (Forbidden, BadRequest)) and _is_no_rights(e.message):
+        return "no_rights"
+    if isinstance(e, Forbidden):
+        return "forbidden"
+    if isinstance(e, BadRequest):
+        m = e.message.lower()
+        if "chat not found" in m or "peer_id_invalid" in m:
+            return "not_found"
+        return "bad_request"
+    if isinstance(e, (TimedOut, NetworkError)):
+        return "transient"
+    return "error"
+
+class RateController:
+    """Flood-aware token bucket shared by all broadcast workers.
+
+    Global rate BCAST_RATE tak tokens deta hai aur har chat ke liye minimum gap
+    rakhta hai. RetryAfter milne par server ka `retry_after` tak sab ruk jate hain,
+    rate aadha hota hai, phir dheere-dheere max tak ramp hota hai.
+    """
+
+    def __init__(self, rate: float = BCAST_RATE, burst: int = BCAST_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._last = asyncio.get_running_loop().time()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._chat_next = {}   # chat_id -> next allowed send time
+        self.stats = {"waited": 0.0, "floods": 0}
+
+    def _refill(self, now: float):
+        elapsed = now - self._last
+        self._last = now
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + BCAST_RAMP * elapsed)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    async def acquire(self, chat_id: int = None):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if chat_id is not None:
+            gap = self._chat_next.get(chat_id, 0.0) - start
+            if gap > 0:
+                await asyncio.sleep(gap)
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        now = loop.time()
+        self.stats["waited"] += now - start
+        metrics.inc("bot_broadcast_pacer_wait_seconds_total", now - start)
+        if chat_id is not None:
+            self._chat_next[chat_id] = now + (GROUP_MIN_GAP if chat_id < 0 else CHAT_MIN_GAP)
+            if len(self._chat_next) > CONCURRENCY * 64:
+                self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+    def penalize(self, retry_after: float):
+        now = asyncio.get_running_loop().time()
+        self.stats["floods"] += 1
+        self._paused_until = max(self._paused_until, now + retry_after)
+        self.rate = max(min(BCAST_RATE_MIN, self.max_rate), self.rate / 2)
+        self.tokens = 0.0
+        self._last = max(self._last, self._paused_until)
+
+class DeliveryLedger:
+    """Buffers per-chat results and streams them to broadcast_deliveries via insert_many."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._buf = []
+
+    def add(self, chat_id: int, status: str, error: str = None):
+        # `at` BSON date hai taki TTL index expire kar sake
+        entry = {"job_id": self.job_id, "chat_id": chat_id, "ok": status == "ok", "status": status,
+                 "at": datetime.now(timezone.utc)}
+        if error:
+            entry["error"] = error[:160]
+        self._buf.append(entry)
+
+    async def flush(self):
+        if not self._buf:
+            return
+        buf, self._buf = self._buf, []
+        try:
+            await deliveries_col.insert_many(buf, ordered=False)
+        except BulkWriteError as e:
+            # duplicate key = resume ke baad pehle se recorded; baaki errors asli hain
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        except Exception:
+            self._buf[:0] = buf
+            raise
+
+class BroadcastRun:
+    """Fixed worker pool fed through a bounded queue from a keyset-paged chat cursor.
+
+    Memory O(CONCURRENCY) rehti hai chahe kitne bhi chats hon. Checkpoint `cursor`
+    sabse chhote in-flight chat se theek pehle tak jata hai, isliye uske neeche
+    sab deliver + ledger me flush ho chuka hota hai.
+    """
+
+    def __init__(self, bot, job):
+        self.bot = bot
+        self.job = job
+        self.job_id = job["_id"]
+        self.bid = job.get("bid", job["_id"])
+        self.shards = job.get("shards", 1)
+        self.target = {**segment_query(job.get("segment") or {}), **shard_filter(job.get("shard", 0), self.shards)}
+        self.retry_of = job.get("retry_of")
+        # ledger bid-wide hai; shard sirf apne chats dekhe
+        self.ledger_shard = shard_filter(job.get("shard", 0), self.shards, "chat_id")
+        self.ledger_q = {"job_id": self.bid, **self.ledger_shard}
+        self.resumed = job.get("attempts", 1) > 1
+        self.queue = asyncio.Queue(maxsize=CONCURRENCY * 2)
+        # Telegram limit poore bot token ka hai -> shards me barabar baanto
+        rate = BCAST_RATE / self.shards
+        if job.get("window") and job.get("total"):
+            # scheduled run: poori list window me phaila do, limit se upar kabhi nahi
+            rate = min(rate, max(job["total"] / job["window"], 0.05))
+        self.pacer = RateController(rate)
+        self.in_flight = set()
+        self.last_dispatched = job.get("cursor")
+        self.success = 0
+        self.failed = 0
+        self.reasons = {}
+        self.dead = []          # (chat_id, reason), checkpoint par bulk prune
+        self.producing = True
+        self.fetched_upto = None
+        self.ledger = DeliveryLedger(self.bid)
+        self._go = asyncio.Event()      # clear = paused
+        self._go.set()
+        self._stop = asyncio.Event()    # cancel: queue drain kiye bina ruk jao
+        self.cancelled = False
+        self._drain = asyncio.Event()   # shutdown: in-flight sends poore, naye chats nahi
+        self.suspended = False
+        self.lost = False               # part ab is instance ka nahi (reclaim/band ho gaya)
+        self._reported = 0.0
+        self.apply_control(job.get("control"))
+
+    def apply_control(self, control):
+        """pause / cancel / None (resume). Button handler aur checkpoint dono call karte hain."""
+        if control == "cancel":
+            self.cancelled = True
+            self._stop.set()
+            self._go.set()
+        elif control == "pause":
+            self._go.clear()
+        else:
+            self._go.set()
+
+    def suspend(self):
+        """Graceful shutdown: workers apna current send poora karke ruk jate hain;
+        job release hota hai aur koi bhi instance cursor se aage chalata hai."""
+        self.suspended = True
+        self._drain.set()
+        self._go.set()   # paused workers bhi jaag kar exit karein (bheje bina)
+
+    async def _produce(self):
+        after = self.job.get("cursor")
+        ledger_max = None
+        if self.resumed:
+            last = await deliveries_col.find_one(self.ledger_q, sort=[("chat_id", -1)])
+            ledger_max = last["chat_id"] if last else None
+        while True:
+            if self.retry_of is not None:
+                page = await _next_retry_batch(self.retry_of, after, BCAST_FETCH, self.ledger_shard)
+            else:
+                page = await _next_target_batch(after, BCAST_FETCH, self.target)
+            if not page:
+                break
+            after = self.fetched_upto = page[-1]
+            batch = page
+            if self.retry_of is not None:
+                batch = await _still_targetable(batch)
+            if ledger_max is not None and batch and batch[0] <= ledger_max:
+                done = set(await deliveries_col.distinct("chat_id", {"job_id": self.bid, "chat_id": {"$in": batch}}))
+                batch = [cid for cid in batch if cid not in done]
+            for cid in batch:
+                self.in_flight.add(cid)
+                await self.queue.put(cid)
+            self.last_dispatched = after
+        self.producing = False
+        for _ in range(CONCURRENCY):
+            await self.queue.put(None)
+
+    async def _work(self):
+        while True:
+            cid = await self.queue.get()
+            if cid is None:
+                return
+            await self._go.wait()
+            if self.suspended:
+                return   # cid in_flight me rehta hai -> cursor usse pehle, resume par jayega
+            await self._deliver(cid)
+            self.in_flight.discard(cid)
+
+    def _record(self, cid: int, status: str, e: Exception = None):
+        self.reasons[status] = self.reasons.get(status, 0) + 1
+        metrics.inc("bot_broadcast_deliveries_total", status=status)
+        if status == "ok":
+            self.success += 1
+        elif status != "migrated":
+            self.failed += 1
+        if status in DEAD_REASONS:
+            self.dead.append((cid, status))
+        self.ledger.add(cid, status, f"{type(e).__name__}: {e}" if e else None)
+
+    async def _deliver(self, cid: int):
+        floods = retries = 0
+        while True:
+            await self._go.wait()
+            await self.pacer.acquire(cid)
             try:
-                await src_msg.copy(chat_id)
-                success += 1
-                details.append({"chat_id": chat_id, "ok": True})
+                await _send_broadcast(self.bot, self.job, cid)
             except Exception as e:
-                failed += 1
-                details.append({"chat_id": chat_id, "ok": False, "error": str(e)})
-
-    i = 0
-    tasks = []
-    async for cid in _iter_target_chats():
-        tasks.append(asyncio.create_task(copy_one(cid)))
-        i += 1
-        if i % SLEEP_EVERY == 0:
-            await asyncio.sleep(SLEEP_TIME)
-    await asyncio.gather(*tasks)
-
-    log = {"mode": "copy", "created_at": now_iso(), "success": success, "failed": failed, "details": details[-50:]}
+                reason = classify_error(e)
+                if reason == "flood":
+                    # failed nahi: global pause ke baad isi chat ko dobara try karo
+                    self.pacer.penalize(retry_after_seconds(e))
+                    floods += 1
+                    if floods < BCAST_MAX_FLOOD:
+                        continue
+                elif reason == "transient" and retries < BCAST_MAX_RETRY:
+                    retries += 1
+                    await asyncio.sleep(BCAST_BACKOFF * 2 ** (retries - 1) + random.random())
+                    continue
+                elif reason == "migrated":
+                    self._record(cid, reason, e)
+                    new_id = e.new_chat_id
+                    await migrate_chat(cid, new_id)
+                    if self.producing and self.fetched_upto is not None and new_id > self.fetched_upto:
+                        return  # producer abhi wahan tak nahi pahuncha, wahi bhejega
+                    cid, floods, retries = new_id, 0, 0
+                    continue
+                self._record(cid, reason, e)
+            else:
+                self._record(cid, "ok")
+            return
+
+    async def checkpoint(self):
+        cursor = (min(self.in_flight) - 1) if self.in_flight else self.last_dispatched
+        await self.ledger.flush()
+        if self.dead:
+            dead, self.dead = self.dead, []
+            for reason in DEAD_REASONS:
+                ids = [cid for cid, r in dead if r == reason]
+                if ids:
+                    await prune_chats(ids, reason)
+        if self.lost:
+            return
+        doc = await bcjobs_col.find_one_and_update(
+            {"_id": self.job_id, "status": "running", "worker": INSTANCE_ID},
+            {"$set": {
+                "cursor": cursor, "success": self.success, "failed": self.failed,
+                "rate": round(self.pacer.rate, 1), "floods": self.pacer.stats["floods"],
+                "reasons": self.reasons,
+                "heartbeat_at": now_iso(),
+            }},
+            projection={"control": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # heartbeat stale hua aur kisi aur ne claim kar liya: ab hum uska cursor
+            # overwrite na karein aur na hi bhejte rahein
+            self.lost = True
+            self._stop.set()
+            self._go.set()
+            return
+        # doosre process me dabaya gaya button yahan pahunchta hai
+        if not self.cancelled:
+            self.apply_control(doc.get("control"))
+
+    async def _checkpoint_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(BCAST_CHECKPOINT)
+            try:
+                await self.checkpoint()
+                if loop.time() - self._reported >= BCAST_PROGRESS_EVERY:
+                    self._reported = loop.time()
+                    await update_broadcast_status(self.bot, self.bid)
+            except Exception:
+                pass
+
+    async def run(self):
+        if self.resumed:
+            self.success = await deliveries_col.count_documents({**self.ledger_q, "ok": True})
+            self.failed = await deliveries_col.count_documents(
+                {**self.ledger_q, "ok": False, "status": {"$ne": "migrated"}}
+            )
+            self.reasons = dict(self.job.get("reasons") or {})
+        workers = [asyncio.create_task(self._work()) for _ in range(CONCURRENCY)]
+        producer = asyncio.create_task(self._produce())
+        ticker = asyncio.create_task(self._checkpoint_loop())
+        stopper = asyncio.create_task(self._stop.wait())
+        drainer = asyncio.create_task(self._drain.wait())
+        fanout = asyncio.gather(producer, *workers)
+        try:
+            await asyncio.wait({fanout, stopper, drainer}, return_when=asyncio.FIRST_COMPLETED)
+            if drainer.done() and not fanout.done() and not stopper.done():
+                producer.cancel()
+                # khali queue par atke workers ko jagao; bhare queue wale agla item lete hi nikalte hain
+                for _ in workers:
+                    try:
+                        self.queue.put_nowait(None)
+                    except asyncio.QueueFull:
+                        break
+                await asyncio.wait(workers)
+            elif fanout.done():
+                fanout.result()
+        finally:
+            # cancel/crash par queued chats drain nahi hote: sab tasks turant band. Har task
+            # alag se cancel, kyunki ek child fail hone par gather "done" ho jata hai aur
+            # fanout.cancel() baaki workers tak nahi pahunchta (wo bhejte rehte)
+            tasks = (ticker, stopper, drainer, producer, *workers)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, fanout, return_exceptions=True)
+            # shutdown/crash par bhi jitna ho chuka wo save ho jaye
+            await self.checkpoint()
+
+# Local runs, taki button dabte hi (bina checkpoint ka wait kiye) control lage
+_active_runs = {}
+
+async def run_broadcast_job(bot, job):
+    run = BroadcastRun(bot, job)
+    _active_runs[run.job_id] = run
+    try:
+        await run.run()
+    finally:
+        _active_runs.pop(run.job_id, None)
+    if run.lost:
+        return   # naya owner hi finish/summary karega
+    if run.suspended and not run.cancelled:
+        # shutdown drain: cursor save ho chuka; stale heartbeat ka wait kiye bina koi bhi utha le
+        await bcjobs_col.update_one({"_id": job["_id"], "status": "running", "worker": INSTANCE_ID},
+                                    {"$set": {"status": "queued", "worker": None, "released_at": now_iso()}})
+        return
+    status = "cancelled" if run.cancelled else "done"
+    res = await bcjobs_col.update_one({"_id": job["_id"], "status": "running", "worker": INSTANCE_ID},
+                                      {"$set": {"status": status, "finished_at": now_iso()}})
+    if res.matched_count:
+        await finish_broadcast(bot, run.bid)
+
+FINISHED = ("done", "cancelled", "error")
+
+async def broadcast_totals(bid) -> dict:
+    """Saare parts (shards) ke counters ka jod."""
+    t = {"success": 0, "failed": 0, "total": 0, "reasons": {}, "parts": 0, "finished": 0,
+         "control": None, "cancelled": False, "error": False}
+    async for part in bcjobs_col.find(_parts_query(bid)):
+        t["parts"] += 1
+        t["success"] += part.get("success", 0)
+        t["failed"] += part.get("failed", 0)
+        t["total"] += part.get("total", 0)
+        for r, n in (part.get("reasons") or {}).items():
+            t["reasons"][r] = t["reasons"].get(r, 0) + n
+        if part.get("status") in FINISHED:
+            t["finished"] += 1
+        if part.get("status") == "cancelled":
+            t["cancelled"] = True
+        if part.get("status") == "error":
+            t["error"] = True
+        t["control"] = t["control"] or part.get("control")
+    # migrated na success hai na failed, par target list me gina gaya tha
+    done = t["success"] + t["failed"] + t["reasons"].get("migrated", 0)
+    t["remaining"] = max(0, t["total"] - done)
+    return t
+
+def fmt_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+def broadcast_control_kb(bid, paused: bool):
+    toggle = InlineKeyboardButton("▶️ Resume", callback_data=f"bcast:resume:{bid}") if paused \
+        else InlineKeyboardButton("⏸ Pause", callback_data=f"bcast:pause:{bid}")
+    return InlineKeyboardMarkup([[toggle, InlineKeyboardButton("🛑 Cancel", callback_data=f"bcast:cancel:{bid}")]])
+
+async def update_broadcast_status(bot, bid, force: bool = False, final: bool = False):
+    """Status message edit karo; throttle head part par claim se (shards me bhi ek hi edit)."""
+    t = await broadcast_totals(bid)
+    now = datetime.now(timezone.utc).timestamp()
+    done = t["success"] + t["failed"]
+    # _parts_query khud "$or" hai: dusra "$or" use overwrite na kare, isliye "$and"
+    conds = [_parts_query(bid), {"shard": {"$in": [0, None]}, "status_message_id": {"$exists": True}}]
+    if not force:
+        conds.append({"$or": [{"progress_ts": {"$exists": False}},
+                              {"progress_ts": {"$lt": now - BCAST_PROGRESS_EVERY + 0.5}}]})
+    q = {"$and": conds}
+    head = await bcjobs_col.find_one_and_update(
+        q, {"$set": {"progress_ts": now, "progress_done": done}},
+    )
+    if not head:
+        return
+    prev_ts = head.get("progress_ts")
+    rate = (done - head.get("progress_done", 0)) / (now - prev_ts) if prev_ts and now > prev_ts else 0.0
+
+    paused = t["control"] == "pause"
+    if final:
+        state = "🛑 Cancelled" if t["cancelled"] else "⚠️ Stopped (error)" if t["error"] else "✅ Finished"
+    else:
+        state = "⏸ Paused" if paused else "🚀 Running"
+    lines = [
+        f"📣 Broadcast `{bid}` — {state}",
+        f"Sent: *{t['success']}* • Failed: *{t['failed']}* • Left: *{t['remaining']}*",
+    ]
+    if not final:
+        eta = fmt_duration(t["remaining"] / rate) if rate > 0 else "—"
+        lines.append(f"Speed: *{rate:.1f}* msg/s • ETA: {eta}")
+        if t["parts"] > 1:
+            lines.append(f"Shards done: {t['finished']}/{t['parts']}")
+    try:
+        await bot.edit_message_text(
+            "\n".join(lines),
+            chat_id=head["status_chat_id"],
+            message_id=head["status_message_id"],
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=None if final else broadcast_control_kb(bid, paused),
+        )
+    except BadRequest:
+        pass   # "message is not modified" / message delete ho gaya
+
+async def finish_broadcast(bot, bid):
+    """Jo part sabse last khatam ho wahi (exactly once) aggregated summary bhejta hai."""
+    if await bcjobs_col.count_documents({**_parts_query(bid), "status": {"$nin": list(FINISHED)}}):
+        return
+    head = await bcjobs_col.find_one_and_update(
+        {**_parts_query(bid), "shard": {"$in": [0, None]}, "notified": {"$ne": True}},
+        {"$set": {"notified": True}},
+    )
+    if not head:
+        return
+    t = await broadcast_totals(bid)
+    success, failed, reasons = t["success"], t["failed"], t["reasons"]
+    pruned = sum(reasons.get(r, 0) for r in DEAD_REASONS)
+    migrated = reasons.get("migrated", 0)
+    try:
+        await update_broadcast_status(bot, bid, force=True, final=True)
+    except Exception:
+        pass
+
+    log = {
+        "mode": head["mode"], "job_id": bid, "created_at": now_iso(),
+        "success": success, "failed": failed, "reasons": reasons,
+        "cancelled": t["cancelled"], "error": t["error"],
+    }
     await bclogs_col.insert_one(log)
-    await update.effective_message.reply_text(f"✅ Done. Sent: *{success}*, Failed: *{failed}*", parse_mode=ParseMode.MARKDOWN)
+    # /stats ek hi document padhe, isliye last broadcast counters doc me bhi
+    last = {k: log[k] for k in ("mode", "created_at", "success", "failed")}
+    await settings_col.update_one({"_id": COUNTERS_ID}, {"$set": {"last_broadcast": last}}, upsert=True)
+    try:
+        await bot.send_message(
+            head["notify_chat_id"],
+            f"{'🛑 Cancelled' if t['cancelled'] else '⚠️ Stopped (error)' if t['error'] else '✅ Done'} "
+            f"`{bid}`. Sent: *{success}*, Failed: *{failed}*\n"
+            f"Pruned dead chats: *{pruned}*, Migrated: *{migrated}*",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+    except Exception:
+        pass
+
+async def broadcast_worker(app: Application):
+    while not _draining:
+        job = None
+        try:
+            job = await claim_broadcast_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        if not job or _draining:
+            if job:
+                # claim ke beech shutdown shuru hua: wapas chhod do
+                await bcjobs_col.update_one({"_id": job["_id"]}, {"$set": {"status": "queued", "worker": None}})
+                break
+            try:
+                await asyncio.wait_for(_bcast_wake.wait(), BCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _bcast_wake.clear()
+            continue
+        try:
+            await run_broadcast_job(app.bot, job)
+        except asyncio.CancelledError:
+            # shutdown: job "running" rehta hai, restart par cursor se resume
+            raise
+        except Exception as e:
+            try:
+                await fail_broadcast_part(app.bot, job, e)
+            except Exception:
+                # Mongo abhi bhi down: part "running" rehta hai, stale heartbeat ke baad wapas aata hai
+                await asyncio.sleep(BCAST_POLL_INTERVAL)
+
+async def fail_broadcast_part(bot, job, e: Exception):
+    """Crash ke baad part backoff ke saath dobara queue; BCAST_MAX_ERRORS par terminal + summary."""
+    errors = job.get("errors", 0) + 1
+    mine = {"_id": job["_id"], "status": "running", "worker": INSTANCE_ID}
+    err = f"{type(e).__name__}: {e}"[:300]
+    if errors < BCAST_MAX_ERRORS:
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=BCAST_ERROR_BACKOFF * 2 ** (errors - 1))
+        await bcjobs_col.update_one(mine, {"$set": {
+            "status": "queued", "worker": None, "errors": errors, "error": err, "not_before": retry_at.isoformat(),
+        }})
+        return
+    res = await bcjobs_col.update_one(mine, {"$set": {
+        "status": "error", "errors": errors, "error": err, "finished_at": now_iso(),
+    }})
+    if res.matched_count:
+        # terminal bhi "finished" hai: sibling shards ke baad summary + status message band
+        await finish_broadcast(bot, job.get("bid", job["_id"]))
+
+async def _announce_broadcast(bot, chat_id: int, bid, reply_to: int = None, title: str = "🚀 Broadcast queued"):
+    """Yahi message live status message banta hai (pause/resume/cancel buttons ke saath)."""
+    status = await bot.send_message(
+        chat_id,
+        f"{title}: `{bid}`",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=broadcast_control_kb(bid, paused=False),
+        reply_to_message_id=reply_to,
+    )
+    await bcjobs_col.update_many(
+        _parts_query(bid),
+        {"$set": {"status_chat_id": status.chat_id, "status_message_id": status.message_id}},
+    )
+
+async def do_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, segment: dict = None):
+    msg = update.effective_message
+    job_id = await enqueue_broadcast("text", update.effective_user.id, msg.chat_id, text=text, segment=segment)
+    await _announce_broadcast(context.bot, msg.chat_id, job_id, reply_to=msg.message_id)
+
+async def do_broadcast_copy(update: Update, context: ContextTypes.DEFAULT_TYPE, src_msg, segment: dict = None):
+    msg = update.effective_message
+    job_id = await enqueue_broadcast(
+        "copy", update.effective_user.id, msg.chat_id,
+        from_chat_id=src_msg.chat_id, message_id=src_msg.message_id, segment=segment,
+    )
+    await _announce_broadcast(context.bot, msg.chat_id, job_id, reply_to=msg.message_id)
+
+BROADCAST_PAYLOAD = ("text", "from_chat_id", "message_id", "message_ids")
+
+# ----- Multi-message sources (copies mode) -----
+# Bot API media_group_id se album ke baaki messages nahi deta, isliye admins ke DM
+# me aaye albums ke ids yahan yaad rakhte hain (track stage se).
+COPY_MAX_IDS = 100      # copy_messages limit
+ALBUM_TRACK_MAX = 500
+_recent_albums = OrderedDict()   # (chat_id, media_group_id) -> [message ids]
+
+def remember_album(msg):
+    key = (msg.chat_id, msg.media_group_id)
+    ids = _recent_albums.setdefault(key, [])
+    if msg.message_id not in ids:
+        ids.append(msg.message_id)
+        ids.sort()
+    _recent_albums.move_to_end(key)
+    while len(_recent_albums) > ALBUM_TRACK_MAX:
+        _recent_albums.popitem(last=False)
+
+def album_ids(msg) -> list:
+    if not msg or not msg.media_group_id:
+        return []
+    return list(_recent_albums.get((msg.chat_id, msg.media_group_id), []))
+
+def _id_span(first: int, n: int) -> list:
+    # limit range banane se pehle: ids=1-999999999 memory me list na bane
+    if not 1 <= n <= COPY_MAX_IDS:
+        raise ValueError(f"Need 1..{COPY_MAX_IDS} message ids")
+    return list(range(first, first + n))
+
+def _parse_ids(value: str) -> list:
+    if "-" in value:
+        a, b = (int(x) for x in value.split("-", 1))
+        if a > b:
+            raise ValueError("Bad ids= range")
+        return _id_span(a, b - a + 1)
+    return sorted({int(x) for x in value.split(",") if x})
+
+def parse_source(args: list, msg):
+    """Leading `count=N`, `ids=a-b|a,b,c`, `from=<chat_id>` -> ((from_chat_id, ids) ya None, rest).
+
+    Bina tokens ke bhi, album item ko reply karne par poora album.
+    """
+    opts = {}
+    while args and args[0].split("=", 1)[0] in ("count", "ids", "from") and "=" in args[0]:
+        k, v = args.pop(0).split("=", 1)
+        opts[k] = v
+    reply = msg.reply_to_message
+    try:
+        if "ids" in opts:
+            from_chat = int(opts.get("from", msg.chat_id))
+            ids = _parse_ids(opts["ids"])
+        elif "count" in opts:
+            if not reply:
+                raise ValueError("count= needs a reply to the first message")
+            from_chat = reply.chat_id
+            ids = _id_span(reply.message_id, int(opts["count"]))
+        else:
+            ids = album_ids(reply)
+            from_chat = reply.chat_id if reply else None
+            if len(ids) < 2:
+                return None, args
+    except ValueError as e:
+        raise ValueError(str(e) if "needs" in str(e) or str(e).startswith("Need") else "Bad count=/ids=/from= value")
+    if not ids or len(ids) > COPY_MAX_IDS:
+        raise ValueError(f"Need 1..{COPY_MAX_IDS} message ids")
+    return (from_chat, ids), args
+
+async def do_broadcast_copies(update: Update, context: ContextTypes.DEFAULT_TYPE, from_chat_id: int,
+                              message_ids: list, segment: dict = None):
+    msg = update.effective_message
+    job_id = await enqueue_broadcast(
+        "copies", update.effective_user.id, msg.chat_id,
+        from_chat_id=from_chat_id, message_ids=message_ids, segment=segment,
+    )
+    await _announce_broadcast(context.bot, msg.chat_id, job_id, reply_to=msg.message_id)
+
+async def retryfailed_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    if not is_admin(uid): return
+    msg = update.effective_message
+    if not context.args:
+        await msg.reply_text("Usage: /retryfailed <broadcast_id>"); return
+    try:
+        bid = ObjectId(context.args[0])
+    except Exception:
+        await msg.reply_text("Invalid broadcast id."); return
+    head = await bcjobs_col.find_one({**_parts_query(bid), "shard": {"$in": [0, None]}})
+    if not head:
+        await msg.reply_text("Broadcast not found."); return
+    if await bcjobs_col.count_documents({**_parts_query(bid), "status": {"$nin": list(FINISHED)}}):
+        await msg.reply_text("That broadcast is still running."); return
+    if not await deliveries_col.find_one(_retry_query(bid)):
+        await msg.reply_text("Nothing to retry ✅"); return
+
+    payload = {k: head[k] for k in BROADCAST_PAYLOAD if k in head}
+    job_id = await enqueue_broadcast(head["mode"], uid, msg.chat_id, retry_of=bid, **payload)
+    await _announce_broadcast(context.bot, msg.chat_id, job_id, reply_to=msg.message_id)
+
+async def broadcast_control_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not is_admin(q.from_user.id):
+        await q.answer("Not allowed", show_alert=True); return
+    _, action, raw = q.data.split(":", 2)
+    try:
+        bid = ObjectId(raw)
+    except Exception:
+        await q.answer("Invalid broadcast id", show_alert=True); return
+    control = {"pause": "pause", "resume": None, "cancel": "cancel"}[action]
+
+    live = {**_parts_query(bid), "status": {"$nin": list(FINISHED)}}
+    await bcjobs_col.update_many(live, {"$set": {"control": control}})
+    if control == "cancel":
+        # abhi tak claim na hue parts seedhe band
+        await bcjobs_col.update_many(
+            {**_parts_query(bid), "status": "queued"},
+            {"$set": {"status": "cancelled", "finished_at": now_iso()}},
+        )
+    for run in list(_active_runs.values()):
+        if run.bid == bid:
+            run.apply_control(control)
+    await q.answer({"pause": "Paused", "resume": "Resumed", "cancel": "Cancelling…"}[action])
+    await update_broadcast_status(context.bot, bid, force=True)
+    if control == "cancel":
+        await finish_broadcast(context.bot, bid)
 
 async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    if not (is_owner(uid) or await is_admin(uid)): return
+    if not (is_owner(uid) or is_admin(uid)): return
+
+    msg = update.effective_message
+    try:
+        segment, args = parse_segment(list(context.args or []))
+    except ValueError as e:
+        await msg.reply_text(f"❌ {e}"); return
+    if args[:1] == ["preview"]:
+        n = await count_targets(segment)
+        await msg.reply_text(f"🎯 Preview: *{n}* chats ({describe_segment(segment)})", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    try:
+        source, args = parse_source(args, msg)
+    except ValueError as e:
+        await msg.reply_text(f"❌ {e}"); return
+    if source:
+        await do_broadcast_copies(update, context, *source, segment)
+    elif msg.reply_to_message:
+        await do_broadcast_copy(update, context, msg.reply_to_message, segment)
+    elif args:
+        text = " ".join(args)
+        await do_broadcast_text(update, context, text, segment)
+    else:
+        await msg.reply_text(
+            "Usage:\n- Reply to a message with /broadcast\n- Or: /broadcast Your message text\n"
+            "Segments (optional, first): type=channel|groups|supergroup|group|private, "
+            "joined_after=2026-01-31|7d, joined_before=...\n"
+            "Add preview after segments to only count targets.\n"
+            "Multi-message (one API call per chat): reply to an album item, or "
+            "count=N (reply to the first), or ids=120-124 [from=<chat_id>]."
+        )
+
+# =============== SCHEDULED BROADCASTS ===============
+# Schedules Mongo me rehte hain (restart-safe); JobQueue sirf timer hai. Har fire
+# `next_run` par atomic claim karta hai, isliye kai instances/shards me bhi ek hi
+# baar chalta hai. Prewarm fire se pehle parts + totals bana deta hai.
+_DUR_RE = re.compile(r"^(\d+)([smhd]?)$")
+_DUR_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(text: str) -> int:
+    m = _DUR_RE.match(text.lower())
+    if not m:
+        raise ValueError(f"bad duration: {text}")
+    return int(m.group(1)) * _DUR_UNITS[m.group(2)]
+
+def parse_when(text: str, now: datetime) -> datetime:
+    """`+30m`, `18:30` (SCHEDULE_TZ, agla occurrence) ya `2026-10-20T18:30`."""
+    now = now.replace(microsecond=0)   # Mongo ms tak hi rakhta hai; next_run equality match rahe
+    if text.startswith("+"):
+        return now + timedelta(seconds=parse_duration(text[1:]))
+    if re.match(r"^\d{1,2}:\d{2}$", text):
+        h, m = map(int, text.split(":"))
+        local = now.astimezone(SCHEDULE_TZ)
+        at = local.replace(hour=h, minute=m, second=0, microsecond=0)
+        if at <= local:
+            at += timedelta(days=1)
+        return at.astimezone(timezone.utc)
+    at = datetime.fromisoformat(text)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=SCHEDULE_TZ)
+    return at.astimezone(timezone.utc)
+
+def _utc(dt: datetime) -> datetime:
+    # Motor naive UTC datetimes lautata hai
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+def _same_run(a, b) -> bool:
+    return a is not None and b is not None and _utc(a) == _utc(b)
+
+def fmt_when(dt: datetime) -> str:
+    return _utc(dt).astimezone(SCHEDULE_TZ).strftime("%Y-%m-%d %H:%M %Z")
+
+def _sched_name(sid) -> str:
+    return f"sched:{sid}"
+
+def arm_schedule(job_queue, doc):
+    """Schedule ke JobQueue timers (prewarm + fire) lagao; purane hata do."""
+    sid = doc["_id"]
+    for j in job_queue.get_jobs_by_name(_sched_name(sid)):
+        j.schedule_removal()
+    now = datetime.now(timezone.utc)
+    due = _utc(doc["next_run"])
+    if not _same_run(doc.get("prewarm_for"), doc["next_run"]) and due - timedelta(seconds=SCHEDULE_PREWARM) > now:
+        job_queue.run_once(prewarm_schedule, due - timedelta(seconds=SCHEDULE_PREWARM),
+                           data=(sid, doc["next_run"]), name=_sched_name(sid))
+    job_queue.run_once(fire_schedule, max(due, now), data=(sid, doc["next_run"]), name=_sched_name(sid))
+
+async def sync_schedules(context: ContextTypes.DEFAULT_TYPE):
+    """Startup + har SCHEDULE_SYNC: jo active schedule yahan armed nahi, use arm karo."""
+    jq = context.job_queue
+    async for doc in schedules_col.find({"status": "active"}):
+        if not jq.get_jobs_by_name(_sched_name(doc["_id"])):
+            arm_schedule(jq, doc)
+
+def _schedule_payload(doc) -> dict:
+    payload = {k: doc[k] for k in BROADCAST_PAYLOAD if k in doc}
+    for k in ("window", "segment"):
+        if doc.get(k):
+            payload[k] = doc[k]
+    return dict(payload, schedule_id=doc["_id"])
+
+async def prewarm_schedule(context: ContextTypes.DEFAULT_TYPE):
+    """Fire se pehle job parts insert (status scheduled) + per-shard target *count*.
+
+    Sirf count hota hai; chat ids fire ke baad BroadcastRun hamesha ki tarah page karta hai.
+    """
+    sid, due = context.job.data
+    bid = ObjectId()
+    doc = await schedules_col.find_one_and_update(
+        {"_id": sid, "status": "active", "next_run": due, "prewarm_for": {"$ne": due}},
+        {"$set": {"prewarm_for": due, "prewarm_bid": bid}},
+    )
+    if not doc:
+        return
+    await enqueue_broadcast(doc["mode"], doc["created_by"], doc["notify_chat_id"],
+                            bid=bid, status="scheduled", **_schedule_payload(doc))
+
+async def fire_schedule(context: ContextTypes.DEFAULT_TYPE):
+    sid, due = context.job.data
+    now = datetime.now(timezone.utc)
+    doc = await schedules_col.find_one({"_id": sid, "status": "active", "next_run": due})
+    if not doc:
+        # kisi aur instance ne chala diya / cancel hua -> DB ki state se dobara arm
+        doc = await schedules_col.find_one({"_id": sid, "status": "active"})
+        if doc:
+            arm_schedule(context.job_queue, doc)
+        return
+
+    every = doc.get("every")
+    upd = {"$set": {"last_run_at": now}, "$inc": {"runs": 1}}
+    if every:
+        nxt = _utc(due) + timedelta(seconds=every)
+        while nxt <= now:   # down the to beech wale runs chhod do
+            nxt += timedelta(seconds=every)
+        upd["$set"]["next_run"] = nxt
+    else:
+        upd["$set"]["status"] = "done"
+    doc = await schedules_col.find_one_and_update(
+        {"_id": sid, "status": "active", "next_run": due}, upd, return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        return
+    if doc.get("status") == "active":
+        arm_schedule(context.job_queue, doc)
+
+    bid = doc.get("prewarm_bid") if _same_run(doc.get("prewarm_for"), due) else None
+    late = (now - _utc(due)).total_seconds()
+    if late > SCHEDULE_GRACE:
+        await schedules_col.update_one({"_id": sid}, {"$inc": {"missed": 1}})
+        if bid:
+            # prewarm ke parts "scheduled" me atke na rahein
+            await bcjobs_col.update_many(
+                {**_parts_query(bid), "status": "scheduled"},
+                {"$set": {"status": "cancelled", "finished_at": now_iso(), "skipped": "late"}},
+            )
+        return
+    if bid and await bcjobs_col.count_documents(_parts_query(bid)):
+        await bcjobs_col.update_many(
+            {**_parts_query(bid), "status": "scheduled"},
+            {"$set": {"status": "queued", "created_at": now_iso()}},
+        )
+        _bcast_wake.set()
+    else:
+        bid = await enqueue_broadcast(doc["mode"], doc["created_by"], doc["notify_chat_id"],
+                                      bid=bid, **_schedule_payload(doc))
+    await schedules_col.update_one({"_id": sid}, {"$set": {"last_bid": bid}})
+    try:
+        await _announce_broadcast(context.bot, doc["notify_chat_id"], bid, title="⏰ Scheduled broadcast started")
+    except Exception:
+        pass
 
+async def schedule_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    if not is_admin(uid): return
     msg = update.effective_message
-    if msg.reply_to_message:
-        await do_broadcast_copy(update, context, msg.reply_to_message)
-    elif context.args:
-        text = " ".join(context.args)
-        await do_broadcast_text(update, context, text)
+    usage = ("Usage: /schedule <when> [every=<dur>] [window=<dur>] [type=...] [text]\n"
+             "when: `+30m`, `18:30`, `2026-10-20T18:30` • dur: `45m`, `2h`, `1d`\n"
+             "Reply to a message to schedule a copy of it.")
+    args = list(context.args or [])
+    if not args:
+        await msg.reply_text(usage, parse_mode=ParseMode.MARKDOWN); return
+    now = datetime.now(timezone.utc)
+    opts = {}
+    seg_tokens = []
+    try:
+        when = parse_when(args.pop(0), now)
+        while args and "=" in args[0]:
+            k, v = args[0].split("=", 1)
+            if k in ("every", "window"):
+                opts[k] = parse_duration(v)
+            elif k in SEGMENT_KEYS:
+                seg_tokens.append(args[0])
+            else:
+                break
+            args.pop(0)
+        segment, _ = parse_segment(seg_tokens)
+    except ValueError:
+        await msg.reply_text(usage, parse_mode=ParseMode.MARKDOWN); return
+    if when <= now:
+        await msg.reply_text("That time is in the past."); return
+
+    doc = {
+        "status": "active",
+        "created_at": now_iso(),
+        "created_by": uid,
+        "notify_chat_id": msg.chat_id,
+        "next_run": when,
+        "every": opts.get("every"),
+        "window": opts.get("window"),
+        "segment": segment,
+        "runs": 0,
+    }
+    album = album_ids(msg.reply_to_message)
+    if len(album) > 1:
+        doc.update(mode="copies", from_chat_id=msg.chat_id, message_ids=album)
+    elif msg.reply_to_message:
+        doc.update(mode="copy", from_chat_id=msg.chat_id, message_id=msg.reply_to_message.message_id)
+    elif args:
+        doc.update(mode="text", text=" ".join(args))
     else:
-        await msg.reply_text("Usage:\n- Reply to a message with /broadcast\n- Or: /broadcast Your message text")
+        await msg.reply_text(usage, parse_mode=ParseMode.MARKDOWN); return
+
+    res = await schedules_col.insert_one(doc)
+    doc["_id"] = res.inserted_id
+    arm_schedule(context.job_queue, doc)
+    extra = ""
+    if doc["every"]:
+        extra += f"\n🔁 Every {fmt_duration(doc['every'])}"
+    if doc["window"]:
+        extra += f"\n🪟 Spread over {fmt_duration(doc['window'])}"
+    if segment:
+        extra += f"\n🎯 {describe_segment(segment)}"
+    await msg.reply_text(f"⏰ Scheduled `{res.inserted_id}` for {fmt_when(when)}{extra}", parse_mode=ParseMode.MARKDOWN)
+
+async def schedules_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    lines = []
+    async for d in schedules_col.find({"status": "active"}).sort("next_run", 1).limit(50):
+        if d["mode"] == "text":
+            what = d.get("text", "")[:30]
+        elif d["mode"] == "copies":
+            what = f"album of {len(d['message_ids'])} msgs"
+        else:
+            what = f"copy of msg {d['message_id']}"
+        line = f"`{d['_id']}` • {fmt_when(d['next_run'])}"
+        if d.get("every"):
+            line += f" • every {fmt_duration(d['every'])}"
+        if d.get("window"):
+            line += f" • window {fmt_duration(d['window'])}"
+        lines.append(f"{line}\n   {what}")
+    if not lines:
+        await update.effective_message.reply_text("No scheduled broadcasts."); return
+    await update.effective_message.reply_text("⏰ Scheduled:\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+async def unschedule_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id): return
+    msg = update.effective_message
+    if not context.args:
+        await msg.reply_text("Usage: /unschedule <schedule_id>"); return
+    try:
+        sid = ObjectId(context.args[0])
+    except Exception:
+        await msg.reply_text("Invalid schedule id."); return
+    doc = await schedules_col.find_one_and_update(
+        {"_id": sid, "status": "active"}, {"$set": {"status": "cancelled", "cancelled_at": now_iso()}},
+    )
+    if not doc:
+        await msg.reply_text("No active schedule with that id."); return
+    for j in context.job_queue.get_jobs_by_name(_sched_name(sid)):
+        j.schedule_removal()
+    if doc.get("prewarm_bid"):
+        await bcjobs_col.update_many(
+            {**_parts_query(doc["prewarm_bid"]), "status": "scheduled"},
+            {"$set": {"status": "cancelled", "finished_at": now_iso()}},
+        )
+    await msg.reply_text(f"🗑️ Unscheduled `{sid}`", parse_mode=ParseMode.MARKDOWN)
 
   # ===================== EMOJI DB HELPERS =====================
-async def get_reaction_emojis() -> list:
-    """Return list of default emojis from DB."""
-    s = await settings_col.find_one({"_id": "reaction_list"})
+# Process-wide cache. Reaction hot path sirf memory se padhta hai; DB read
+# sirf cold start (miss) par ya watcher ke refresh par hota hai.
+_reaction_emojis = None
+emoji_cache_stats = {"hits": 0, "misses": 0, "refreshes": 0}
+
+def _parse_reaction_doc(s) -> list:
     if s and "emojis" in s and isinstance(s["emojis"], list):
-        return s["emojis"]
+        return list(s["emojis"])
     return [DEFAULT_REACTION_EMOJI]
 
-async def add_reaction_emoji(emoji: str):
-    """Add emoji to default list."""
-    emojis = await get_reaction_emojis()
-    if emoji not in emojis:
-        emojis.append(emoji)
+async def refresh_reaction_emojis() -> list:
+    """Reload emoji list from DB into the cache."""
+    global _reaction_emojis
+    s = await settings_col.find_one({"_id": "reaction_list"})
+    _reaction_emojis = _parse_reaction_doc(s)
+    emoji_cache_stats["refreshes"] += 1
+    return _reaction_emojis
+
+async def get_reaction_emojis() -> list:
+    """Return list of default emojis (cached; treat as read-only)."""
+    if _reaction_emojis is not None:
+        emoji_cache_stats["hits"] += 1
+        return _reaction_emojis
+    emoji_cache_stats["misses"] += 1
+    return await refresh_reaction_emojis()
+
+async def _save_reaction_emojis(emojis: list):
+    global _reaction_emojis
     await settings_col.update_one(
         {"_id": "reaction_list"},
         {"$set": {"emojis": emojis, "updated_at": now_iso()}},
         upsert=True
     )
+    _reaction_emojis = emojis
+
+async def add_reaction_emoji(emoji: str):
+    """Add emoji to default list."""
+    emojis = list(await get_reaction_emojis())
+    if emoji not in emojis:
+        emojis.append(emoji)
+    await _save_reaction_emojis(emojis)
 
 async def remove_reaction_emoji(emoji: str):
     """Remove emoji from default list."""
-    emojis = await get_reaction_emojis()
+    emojis = list(await get_reaction_emojis())
     if emoji in emojis:
         emojis.remove(emoji)
-    await settings_col.update_one(
-        {"_id": "reaction_list"},
-        {"$set": {"emojis": emojis, "updated_at": now_iso()}},
-        upsert=True
-    )
+    await _save_reaction_emojis(emojis)
+
+async def watch_reaction_emojis():
+    """Keep the cache in sync when several instances share one DB.
+
+    Change stream use karta hai; replica set na ho to TTL polling par gir jata hai.
+    """
+    global _reaction_emojis
+    while True:
+        try:
+            pipeline = [{"$match": {"documentKey._id": "reaction_list"}}]
+            async with settings_col.watch(pipeline, full_document="updateLookup") as stream:
+                # stream khulne se pehle ke changes miss na hon
+                await refresh_reaction_emojis()
+                async for change in stream:
+                    _reaction_emojis = _parse_reaction_doc(change.get("fullDocument"))
+                    emoji_cache_stats["refreshes"] += 1
+        except OperationFailure:
+            # Standalone mongod: change streams supported nahi
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(EMOJI_CACHE_TTL)
+
+    while True:
+        await asyncio.sleep(EMOJI_CACHE_TTL)
+        try:
+            await refresh_reaction_emojis()
+        except Exception:
+            pass
 
 # ===================== EMOJI COMMANDS =====================
 async def list_reactions_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id):
         return
     emojis = await get_reaction_emojis()
+    cs = emoji_cache_stats
+    rs = reaction_dispatcher.stats
+    ps = reaction_policies.stats
     await update.effective_message.reply_text(
-        f"🎯 Current Reaction Emojis:\n{' '.join(emojis)}",
+        f"🎯 Current Reaction Emojis:\n{' '.join(emojis)}\n\n"
+        f"Cache: hits {cs['hits']} • misses {cs['misses']} • refreshes {cs['refreshes']}\n"
+        f"Dispatch: queued {rs['queued']} • sent {rs['sent']} • dropped {rs['dropped']} • "
+        f"albums {rs['coalesced']} • retried {rs['retried']} • failed {rs['failed']} • "
+        f"pending {reaction_dispatcher.depth()}\n"
+        f"Chat policies: cached {len(reaction_policies._data)} • hits {ps['hits']} • "
+        f"misses {ps['misses']} • evicted {ps['evictions']} • react-all groups {len(_react_all_chats)}",
         parse_mode=ParseMode.MARKDOWN
     )
 
+def _fmt_policy(chat_id: int, policy: dict) -> str:
+    return (
+        f"🎛 Reaction policy for `{chat_id}`\n"
+        f"Mode: *{policy.get('mode', 'default')}* • Sample: *{policy.get('sample', 1.0):g}* • "
+        f"Big: *{'on' if policy.get('big') else 'off'}*\n"
+        f"Emojis: {' '.join(policy['emojis']) if policy.get('emojis') else 'global list'}"
+    )
+
+async def chatreact_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_owner(update.effective_user.id):
+        return
+    msg = update.effective_message
+    usage = ("Usage: /chatreact <chat_id> [mode=all|mentions|off|default] [sample=0.5] "
+             "[big=on|off] [emojis=👍,🔥|default]\n/chatreact <chat_id> reset")
+    args = list(context.args or [])
+    try:
+        chat_id = int(args.pop(0))
+    except (IndexError, ValueError):
+        await msg.reply_text(usage); return
+
+    if not args:
+        doc = await chats_col.find_one({"_id": chat_id}, {"reaction": 1})
+        if doc is None:
+            await msg.reply_text("Chat not found."); return
+        await msg.reply_text(_fmt_policy(chat_id, doc.get("reaction") or {}), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    changes = {}
+    reset = args == ["reset"]
+    try:
+        for tok in ([] if reset else args):
+            key, value = tok.split("=", 1)
+            value = value.strip()
+            if key == "mode":
+                if value not in REACT_MODES + ("default",):
+                    raise ValueError
+                changes["mode"] = None if value == "default" else value
+            elif key == "sample":
+                changes["sample"] = min(1.0, max(0.0, float(value)))
+            elif key == "big":
+                changes["big"] = value.lower() in ("on", "yes", "true", "1")
+            elif key == "emojis":
+                changes["emojis"] = None if value == "default" else [e for e in value.split(",") if e]
+            else:
+                raise ValueError
+    except ValueError:
+        await msg.reply_text(usage); return
+
+    policy = await set_reaction_policy(chat_id, changes, reset=reset)
+    if policy is None:
+        await msg.reply_text("Chat not found."); return
+    await msg.reply_text("✅ Updated\n" + _fmt_policy(chat_id, policy), parse_mode=ParseMode.MARKDOWN)
+
 async def addreaction_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_owner(update.effective_user.id):
         return
@@ -514,59 +2607,287 @@ async def delreaction_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_message.reply_text(f"🗑 Removed reaction emoji: {emoji}")
 
 # ===================== AUTO-REACTIONS =====================
-async def auto_react_for_group_mentions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = update.effective_message
-    if not msg or msg.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
-        return
-
-    bot_username = (await context.bot.get_me()).username or ""
-    if not bot_username:
-        return
+# Bot identity startup par ek baar resolve hoti hai (get_me har message par nahi).
+BOT_ID = None
+BOT_USERNAME = ""
+_mention_tag = None   # "@username" lowercase, startup par ek baar
+
+def set_bot_identity(bot_id: int, username: str):
+    global BOT_ID, BOT_USERNAME, _mention_tag
+    BOT_ID = bot_id
+    BOT_USERNAME = username or ""
+    _mention_tag = f"@{BOT_USERNAME.lower()}" if BOT_USERNAME else None
+
+def is_bot_mentioned(msg) -> bool:
+    """Entity-based: Telegram har @mention ko entity deta hai, text scan ki zarurat nahi.
+
+    Bina entities wale messages (zyada traffic) pehli line par hi reject.
+    """
+    entities = msg.entities or msg.caption_entities
+    if not entities or _mention_tag is None:
+        return False
+    parse = msg.parse_entity if msg.entities else msg.parse_caption_entity
+    for e in entities:
+        if e.type == MessageEntity.MENTION:
+            # username ASCII hai, to UTF-16 length = len(tag); baaki mentions bina slicing ke skip
+            if e.length == len(_mention_tag) and parse(e).lower() == _mention_tag:
+                return True
+        elif e.type == MessageEntity.TEXT_MENTION and e.user and e.user.id == BOT_ID:
+            return True
+    return False
+
+class BotMentioned(filters.MessageFilter):
+    """Handler filter: non-mention group messages koi coroutine schedule hone se pehle drop."""
+
+    __slots__ = ()
+
+    def filter(self, message) -> bool:
+        return is_bot_mentioned(message)
+
+BOT_MENTIONED = BotMentioned(name="BotMentioned")
+
+# Priority: mention (user ne tag kiya, turant dikhe) > channel post > group "all" mode
+PRIO_MENTION = 0
+PRIO_CHANNEL = 1
+PRIO_GROUP   = 2
+
+# ----- Per-chat reaction policy -----
+# chat doc par `reaction`: {emojis: [...], mode: all|mentions|off, sample: 0..1, big: bool}
+# Missing keys = default (global emojis, groups "mentions", channels "all", sample 1).
+REACT_MODES = ("all", "mentions", "off")
+
+class ReactionPolicyCache:
+    """Size-bounded LRU + TTL over chat docs' `reaction` field.
+
+    Hot path par sirf dict lookup; miss par ek find_one (concurrent misses ek hi
+    read share karte hain), phir REACT_POLICY_TTL tak memory se.
+    """
+
+    def __init__(self, maxsize: int = REACT_POLICY_CACHE, ttl: float = REACT_POLICY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # chat_id -> (expires, policy)
+        self._loading = {}           # chat_id -> Future
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    async def get(self, chat_id: int) -> dict:
+        now = time.monotonic()
+        hit = self._data.get(chat_id)
+        if hit and hit[0] > now:
+            self._data.move_to_end(chat_id)
+            self.stats["hits"] += 1
+            return hit[1]
+        self.stats["misses"] += 1
+        fut = self._loading.get(chat_id)
+        if fut:
+            return await asyncio.shield(fut)
+        fut = self._loading[chat_id] = asyncio.get_running_loop().create_future()
+        try:
+            doc = await chats_col.find_one({"_id": chat_id}, {"reaction": 1})
+            policy = (doc or {}).get("reaction") or {}
+            self.put(chat_id, policy)
+            fut.set_result(policy)
+            return policy
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()   # waiters na hon to "never retrieved" warning nahi
+            raise
+        finally:
+            self._loading.pop(chat_id, None)
+
+    def put(self, chat_id: int, policy: dict):
+        self._data[chat_id] = (time.monotonic() + self.ttl, policy)
+        self._data.move_to_end(chat_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, chat_id: int):
+        self._data.pop(chat_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+reaction_policies = ReactionPolicyCache()
+
+# Groups jinka mode "all" hai: chhota set, startup + har TTL par reload. Mention filter
+# ke saath sync filter me use hota hai, taki baaki groups ke non-mention messages
+# pehle jaise hi bina coroutine ke drop hon.
+_react_all_chats = set()
+
+async def refresh_react_all_chats():
+    global _react_all_chats
+    _react_all_chats = set(await chats_col.distinct("_id", {"reaction.mode": "all", "left_at": {"$exists": False}}))
+
+async def watch_reaction_policies():
+    while True:
+        await asyncio.sleep(REACT_POLICY_TTL)
+        try:
+            await refresh_react_all_chats()
+        except Exception:
+            pass
+
+class ReactAllChat(filters.MessageFilter):
+    __slots__ = ()
+
+    def filter(self, message) -> bool:
+        return message.chat_id in _react_all_chats
+
+REACT_ALL_CHAT = ReactAllChat(name="ReactAllChat")
+
+def _policy_allows(policy: dict, is_channel: bool, mentioned: bool) -> bool:
+    mode = policy.get("mode") or ("all" if is_channel else "mentions")
+    if mode == "off" or (mode == "mentions" and not mentioned):
+        return False
+    sample = policy.get("sample", 1.0)
+    return sample >= 1.0 or random.random() < sample
+
+async def set_reaction_policy(chat_id: int, changes: dict, reset: bool = False) -> dict:
+    """Owner command path: chat doc update + cache/all-set invalidate."""
+    if reset:
+        doc = await chats_col.find_one_and_update(
+            {"_id": chat_id}, {"$unset": {"reaction": ""}}, return_document=ReturnDocument.AFTER
+        )
+    else:
+        sets = {f"reaction.{k}": v for k, v in changes.items() if v is not None}
+        unsets = {f"reaction.{k}": "" for k, v in changes.items() if v is None}
+        update = {}
+        if sets:
+            update["$set"] = sets
+        if unsets:
+            update["$unset"] = unsets
+        doc = await chats_col.find_one_and_update({"_id": chat_id}, update, return_document=ReturnDocument.AFTER)
+    if doc is None:
+        return None
+    policy = doc.get("reaction") or {}
+    reaction_policies.put(chat_id, policy)
+    if policy.get("mode") == "all":
+        _react_all_chats.add(chat_id)
+    else:
+        _react_all_chats.discard(chat_id)
+    return policy
+
+class ReactionDispatcher:
+    """Priority queue + worker pool for set_message_reaction, outside the update handlers.
+
+    Albums ek media_group_id par ek reaction me coalesce hote hain; har chat me
+    REACT_CHAT_GAP ka gap; RetryAfter par sab workers server ka wait maante hain
+    aur item dobara queue hota hai.
+    """
+
+    def __init__(self):
+        self._q = asyncio.PriorityQueue(REACT_QUEUE_MAX)
+        self._seq = itertools.count()
+        self._albums = {}      # (chat_id, media_group_id) -> expiry
+        self._chat_next = {}   # chat_id -> next allowed time
+        self._paused_until = 0.0
+        self._later = 0        # call_later se wapas aane wale items (chat gap / RetryAfter)
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "coalesced": 0, "retried": 0, "failed": 0}
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    async def drain(self):
+        """Queue + in-progress + deferred items khatam hone tak wait (shutdown par)."""
+        while True:
+            await self._q.join()
+            if not self._later:
+                return
+            await asyncio.sleep(0.05)
+
+    def _put(self, item) -> bool:
+        try:
+            self._q.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        return True
 
-    text = (msg.text or "") + " " + (msg.caption or "")
-    mentioned = False
+    def _put_later(self, delay: float, item):
+        self._later += 1
+        asyncio.get_running_loop().call_later(delay, self._put_deferred, item)
+
+    def _put_deferred(self, item):
+        self._later -= 1
+        self._put(item)
+
+    def submit(self, chat_id: int, message_id: int, prio: int, media_group_id: str = None,
+               policy: dict = None) -> bool:
+        now = asyncio.get_running_loop().time()
+        if media_group_id:
+            key = (chat_id, media_group_id)
+            if self._albums.get(key, 0) > now:
+                self.stats["coalesced"] += 1
+                return False
+            if len(self._albums) > REACT_QUEUE_MAX:
+                self._albums = {k: t for k, t in self._albums.items() if t > now}
+            self._albums[key] = now + REACT_ALBUM_TTL
+        if not self._put((prio, next(self._seq), chat_id, message_id, 0, policy or {})):
+            return False
+        self.stats["queued"] += 1
+        return True
 
-    if f"@{bot_username}".lower() in text.lower():
-        mentioned = True
-    else:
-        entities = (msg.entities or []) + (msg.caption_entities or [])
-        for ent in entities:
-            if ent.type == "mention":
-                ent_text = text[ent.offset: ent.offset + ent.length]
-                if ent_text.lower() == f"@{bot_username}".lower():
-                    mentioned = True
-                    break
+    async def run(self, bot):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._q.get()
+            try:
+                await self._react(bot, loop, item)
+            finally:
+                self._q.task_done()
+
+    async def _react(self, bot, loop, item):
+        prio, seq, chat_id, message_id, tries, policy = item
+        now = loop.time()
+        if now < self._paused_until:
+            await asyncio.sleep(self._paused_until - now)
+            now = loop.time()
+        wait = self._chat_next.get(chat_id, 0.0) - now
+        if wait > 0:
+            # worker ko block mat karo; chat ka slot aane par wapas queue
+            self._put_later(wait, item)
+            return
+        self._chat_next[chat_id] = now + REACT_CHAT_GAP
+        if len(self._chat_next) > REACT_QUEUE_MAX:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        try:
+            emojis = policy.get("emojis") or await get_reaction_emojis()
+            await bot.set_message_reaction(
+                chat_id=chat_id,
+                message_id=message_id,
+                reaction=[ReactionTypeEmoji(random.choice(emojis))],
+                is_big=bool(policy.get("big"))
+            )
+            self.stats["sent"] += 1
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            self._paused_until = max(self._paused_until, loop.time() + delay)
+            if tries + 1 < REACT_MAX_TRIES:
+                self.stats["retried"] += 1
+                self._put_later(delay, (prio, seq, chat_id, message_id, tries + 1, policy))
+            else:
+                self.stats["dropped"] += 1
+        except Exception:
+            self.stats["failed"] += 1
+
+reaction_dispatcher = ReactionDispatcher()
 
-    if not mentioned:
+async def auto_react_for_group_mentions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # filter: GROUPS & (BOT_MENTIONED | REACT_ALL_CHAT) pehle hi check ho chuka
+    msg = update.effective_message
+    mentioned = is_bot_mentioned(msg)
+    policy = await reaction_policies.get(msg.chat_id)
+    if not _policy_allows(policy, False, mentioned):
         return
-
-    try:
-        emojis = await get_reaction_emojis()
-        chosen = random.choice(emojis)
-        await context.bot.set_message_reaction(
-            chat_id=msg.chat_id,
-            message_id=msg.id,
-            reaction=[ReactionTypeEmoji(chosen)],
-            is_big=False
-        )
-    except Exception:
-        pass
+    prio = PRIO_MENTION if mentioned else PRIO_GROUP
+    reaction_dispatcher.submit(msg.chat_id, msg.id, prio, msg.media_group_id, policy)
 
 async def auto_react_for_channel_posts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message
-    if not msg or msg.chat.type != ChatType.CHANNEL:
+    policy = await reaction_policies.get(msg.chat_id)
+    if not _policy_allows(policy, True, False):
         return
-    try:
-        emojis = await get_reaction_emojis()
-        chosen = random.choice(emojis)
-        await context.bot.set_message_reaction(
-            chat_id=msg.chat_id,
-            message_id=msg.id,
-            reaction=[ReactionTypeEmoji(chosen)],
-            is_big=False
-        )
-    except Exception:
-        pass
+    reaction_dispatcher.submit(msg.chat_id, msg.id, PRIO_CHANNEL, msg.media_group_id, policy)
 
 # =============== CHAT MEMBER UPDATES ===============
 async def my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -593,16 +2914,23 @@ async def menu_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if need_owner and not is_owner(uid):
             await q.answer("Owner only.", show_alert=True)
             return False
-        if need_admin and not (is_owner(uid) or await is_admin(uid)):
+        if need_admin and not (is_owner(uid) or is_admin(uid)):
             await q.answer("Admins only.", show_alert=True)
             return False
         return True
 
     if data.startswith("menu:list:"):
         if not await ensure_auth(need_owner=True): return
-        page = int(data.split(":")[-1])
+        # menu:list:<page>[:a|b:<chat_id>]
+        parts = data.split(":")[2:]
+        page = int(parts[0])
         await q.answer()
-        await send_chat_page(q.message.chat_id, context, max(1, page)); return
+        if len(parts) == 3:
+            key = int(parts[2])
+            if parts[1] == "a":
+                await send_chat_page(q.message.chat_id, context, page, after=key); return
+            await send_chat_page(q.message.chat_id, context, page, before=key); return
+        await send_chat_page(q.message.chat_id, context, 1); return
 
     if data == "menu:stats":
         if not await ensure_auth(need_admin=True): return
@@ -646,22 +2974,434 @@ async def menu_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def save_on_new_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     if chat:
-        await upsert_chat(chat)
+        chat_registry.note(chat)
+    msg = update.effective_message
+    # admin ke DM me album -> /broadcast reply par poora album copy ho sake
+    if msg and msg.media_group_id and chat.type == ChatType.PRIVATE and is_admin(chat.id):
+        remember_album(msg)
+
+# =============== LIFECYCLE ===============
+# post_init (on_startup): Mongo client + health check + indexes + cache warm-up, sab
+# updates lene se pehle. post_stop (on_stop): intake band ho chuka, PTB pending updates
+# process kar chuka; ab apni queues DRAIN_TIMEOUT me drain. post_shutdown: baaki cancel.
+_bg_tasks = []
+_bcast_task = None
+_metrics_runner = None
+lifecycle = {"ready": False, "draining": False, "startup_s": None, "mongo_ping_ms": None, "drain_s": None}
+
+def register_gauges(app: Application):
+    metrics.gauge("bot_uptime_seconds", lambda: time.time() - metrics.started)
+    metrics.gauge("bot_update_queue", lambda: app.update_queue.qsize())
+    metrics.gauge("bot_updates_in_progress", lambda: {(("state", k),): update_processor.stats[k]
+                                                      for k in ("waiting", "active")})
+    metrics.gauge("bot_updates_processed", lambda: update_processor.stats["processed"])
+    metrics.gauge("bot_updates_dropped", lambda: update_processor.stats["dropped"])
+    metrics.gauge("bot_reaction_queue", reaction_dispatcher.depth)
+    metrics.gauge("bot_reactions", lambda: {(("result", k),): v for k, v in reaction_dispatcher.stats.items()})
+    metrics.gauge("bot_emoji_cache", lambda: {(("result", k),): v for k, v in emoji_cache_stats.items()})
+    metrics.gauge("bot_reaction_policy_cache", lambda: {(("result", k),): v
+                                                        for k, v in reaction_policies.stats.items()})
+    metrics.gauge("bot_chat_registry_pending", lambda: len(chat_registry._dirty))
+    metrics.gauge("bot_broadcast_active_runs", lambda: len(_active_runs))
+    metrics.gauge("bot_broadcast_pacer_rate", lambda: sum(r.pacer.rate for r in _active_runs.values()))
+    metrics.gauge("bot_broadcast_sent", lambda: sum(r.success for r in _active_runs.values()))
+
+async def start_metrics_server():
+    global _metrics_runner
+    async def view(request: web.Request):
+        return web.Response(body=metrics.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", view)
+    _metrics_runner = web.AppRunner(web_app, access_log=None)
+    await _metrics_runner.setup()
+    # shard k apne port (METRICS_PORT + k) par, taki ek dyno me clash na ho
+    await web.TCPSite(_metrics_runner, METRICS_LISTEN, METRICS_PORT + (SHARD_INDEX or 0)).start()
+
+async def on_startup(app: Application):
+    global _bcast_task
+    t = time.perf_counter()
+    init_mongo()
+    lifecycle["mongo_ping_ms"] = round(await mongo_health_check() * 1000, 1)
+    # initialize() already called getMe; bot.id/username wahi cached values hain
+    set_bot_identity(app.bot.id, app.bot.username)
+    await ensure_indexes()
+    await ensure_chat_counters()
+    await refresh_reaction_emojis()
+    await refresh_admins()
+    await refresh_react_all_chats()
+    _bg_tasks.append(asyncio.create_task(watch_reaction_emojis()))
+    _bg_tasks.append(asyncio.create_task(watch_reaction_policies()))
+    _bg_tasks.append(asyncio.create_task(watch_admins()))
+    _bg_tasks.append(asyncio.create_task(chat_registry.run()))
+    _bcast_task = asyncio.create_task(broadcast_worker(app))
+    _bg_tasks.append(_bcast_task)
+    for _ in range(REACT_WORKERS):
+        _bg_tasks.append(asyncio.create_task(reaction_dispatcher.run(app.bot)))
+    if SHARD_INDEX is not None:
+        _bg_tasks.append(asyncio.create_task(publish_shard_stats()))
+    app.job_queue.run_repeating(sync_schedules, interval=SCHEDULE_SYNC, first=1, name="sync_schedules")
+    register_gauges(app)
+    if METRICS_PORT:
+        await start_metrics_server()
+    lifecycle["startup_s"] = round(time.perf_counter() - t, 2)
+    lifecycle["ready"] = True
+
+async def _drain_queues():
+    await reaction_dispatcher.drain()
+    if _bcast_task:
+        await asyncio.wait({_bcast_task})
+    await chat_registry.flush()
+
+async def on_stop(app: Application):
+    global _draining
+    lifecycle["ready"] = False
+    lifecycle["draining"] = True
+    t = time.perf_counter()
+    _draining = True
+    _bcast_wake.set()
+    for run in list(_active_runs.values()):
+        run.suspend()
+    try:
+        await asyncio.wait_for(_drain_queues(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass   # deadline: on_shutdown cancel karega; broadcast cursor phir bhi checkpoint hota hai
+    except Exception:
+        pass
+    lifecycle["drain_s"] = round(time.perf_counter() - t, 2)
+
+async def on_shutdown(app: Application):
+    for t in _bg_tasks:
+        t.cancel()
+    await asyncio.gather(*_bg_tasks, return_exceptions=True)
+    _bg_tasks.clear()
+    if _metrics_runner:
+        await _metrics_runner.cleanup()
+    if mongo is not None:
+        # pending chat writes drop na hon
+        try:
+            await chat_registry.flush()
+        finally:
+            mongo.close()
+
+# =============== UPDATE PROCESSING ===============
+def _update_key(update: object):
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+    return None
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Concurrent update processing keyed on chat_id.
+
+    Har chat ka apna FIFO lock hai, to ek chat ke updates order me chalte hain
+    jabki doosre chats parallel. Concurrency limit (UPDATE_CONCURRENCY) chat lock ke
+    *baad* lagti hai. PTB ka backlog semaphore (UPDATE_BACKLOG) lock se *pehle* lagta
+    hai aur chat ki baari ka wait usi slot ko pakad kar hota hai, isliye ek chat
+    UPDATE_CHAT_BACKLOG se zyada pending updates nahi rakh sakti; baaki drop hote hain
+    taki ek flood karti chat poora backlog na bhar de.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(UPDATE_BACKLOG)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = {}   # key -> [lock, users]
+        self.stats = {"waiting": 0, "active": 0, "processed": 0, "dropped": 0}
+
+    async def do_process_update(self, update, coroutine):
+        key = _update_key(update)
+        entry = None
+        if key is not None:
+            entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+            if entry[1] >= UPDATE_CHAT_BACKLOG:
+                self.stats["dropped"] += 1
+                coroutine.close()
+                return
+            entry[1] += 1
+        self.stats["waiting"] += 1
+        started = False
+        queued = time.perf_counter()
+        try:
+            async with (entry[0] if entry else contextlib.nullcontext()):
+                async with self._slots:
+                    self.stats["waiting"] -= 1
+                    self.stats["active"] += 1
+                    started = True
+                    t = time.perf_counter()
+                    metrics.observe("bot_update_wait_seconds", t - queued)
+                    await coroutine
+                    # filters + sab groups ke blocking handlers (block=False wale stage metric me)
+                    metrics.observe("bot_update_seconds", time.perf_counter() - t)
+        finally:
+            if started:
+                self.stats["active"] -= 1
+                self.stats["processed"] += 1
+            else:
+                self.stats["waiting"] -= 1
+                coroutine.close()
+            if entry:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._chat_locks.pop(key, None)
+
+    async def initialize(self):
+        pass
 
-# =============== MAIN ===============
-def main():
-    if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        raise RuntimeError("Please set BOT_TOKEN (env or constant).")
+    async def shutdown(self):
+        pass
 
-    app = Application.builder()\
+update_processor = ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY)
+
+def update_backlog(app: Application) -> dict:
+    """Queue-depth gauge: fetch queue + chat-lock/slot wait + running."""
+    return {"queued": app.update_queue.qsize(), **update_processor.stats}
+
+# =============== WEBHOOK ===============
+ALLOWED_UPDATES = [
+    "message", "channel_post", "callback_query", "my_chat_member", "chat_member",
+    "message_reaction", "message_reaction_count"
+]
+
+def make_webhook_app(deliver, health) -> web.Application:
+    async def receive(request: web.Request):
+        if WEBHOOK_SECRET:
+            # constant-time compare: response timing se secret ka prefix guess na ho
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Telegram ko turant 200; processing queue se hoti hai
+        await deliver(data)
+        return web.Response()
+
+    async def health_view(request: web.Request):
+        h = health()
+        ok = h.get("ready", True) and not h.get("draining")
+        return web.json_response({"ok": ok, **h}, status=200 if ok else 503)
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, receive)
+    web_app.router.add_get("/healthz", health_view)
+    return web_app
+
+async def serve_webhook(bot, deliver, health, stop: asyncio.Event):
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("Please set WEBHOOK_SECRET when WEBHOOK_URL is public.")
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    runner = web.AppRunner(make_webhook_app(deliver, health))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, PORT).start()
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+def _stop_on_signals(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+def _app_deliver(app: Application):
+    async def deliver(data: dict):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+    return deliver
+
+async def run_embedded(app: Application, intake, handle_signals: bool = True):
+    """run_polling jaisa lifecycle, par updates `intake(stop)` deta hai (webhook / shard IPC)."""
+    stop = asyncio.Event()
+    if handle_signals:
+        _stop_on_signals(stop)
+    # initialize -> post_init -> start ... stop -> post_stop -> shutdown -> post_shutdown
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await intake(stop)
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# =============== SHARDING ===============
+def raw_update_key(data: dict):
+    """chat_id (ya user id) straight from update JSON, bina de_json ke."""
+    for k, v in data.items():
+        if k == "update_id" or not isinstance(v, dict):
+            continue
+        chat = v.get("chat") or (v.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+        user = v.get("from") or v.get("user")
+        if user:
+            return user.get("id")
+    return None
+
+async def publish_shard_stats():
+    """Har shard apne runtime counters likhta hai taki /stats sab shards ka jod dikhaye."""
+    while True:
+        try:
+            await settings_col.update_one(
+                {"_id": f"shard:{SHARD_INDEX}"},
+                {"$set": {
+                    "at": now_iso(),
+                    "pid": os.getpid(),
+                    "updates": update_processor.stats["processed"],
+                    "reactions": dict(reaction_dispatcher.stats),
+                    "chats_seen": chat_registry.stats["seen"],
+                }},
+                upsert=True,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        await asyncio.sleep(SHARD_STATS_EVERY)
+
+async def _pump_ipc(app: Application, q):
+    """Router ka None sentinel aane tak queue drain karo: router ne jo bheja wo sab
+    process hota hai. Sentinel router shutdown par hi bhejta hai."""
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            data = await loop.run_in_executor(None, q.get, True, 1.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break   # router SIGKILL hua, sentinel kabhi nahi aayega
+            continue
+        if data is None:
+            break
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+def run_shard(index: int, q):
+    """Shard process entrypoint (router spawn karta hai)."""
+    global SHARD_INDEX
+    # Ctrl-C / dyno SIGTERM poore process group ko milta hai. Shard khud nahi rukta:
+    # router intake band karke sentinel bhejta hai, tab tak shard queue drain karta hai
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    SHARD_INDEX = index
+    app = build_application(external_updates=True)
+    asyncio.run(run_embedded(app, lambda stop: _pump_ipc(app, q), handle_signals=False))
+
+async def poll_updates(bot, deliver, stop: asyncio.Event):
+    await bot.delete_webhook()
+    offset = None
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        while not stop.is_set():
+            poll = asyncio.create_task(bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES
+            ))
+            await asyncio.wait({poll, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            if not poll.done():
+                poll.cancel()
+                break
+            try:
+                updates = poll.result()
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e)); continue
+            except (TimedOut, NetworkError):
+                await asyncio.sleep(1); continue
+            for u in updates:
+                await deliver(u.to_dict())
+                offset = u.update_id + 1
+    finally:
+        stopper.cancel()
+
+async def run_router():
+    """SHARDS>1: updates lo (polling/webhook) aur chat_id hash se shard process ko bhejo."""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(SHARDS)]
+    procs = [None] * SHARDS
+    routed = [0] * SHARDS
+
+    def spawn(i: int):
+        procs[i] = ctx.Process(target=run_shard, args=(i, queues[i]), name=f"shard-{i}")
+        procs[i].start()
+
+    async def deliver(data: dict):
+        key = raw_update_key(data)
+        i = shard_for(key) if key is not None else 0
+        queues[i].put(data)
+        routed[i] += 1
+
+    def health() -> dict:
+        return {"shards": SHARDS, "alive": sum(p.is_alive() for p in procs), "routed": routed}
+
+    async def supervise(stop: asyncio.Event):
+        while not stop.is_set():
+            await asyncio.sleep(5)
+            for i, p in enumerate(procs):
+                if not p.is_alive() and not stop.is_set():
+                    spawn(i)   # queue wahi rehti hai, pending updates nahi khote
+
+    for i in range(SHARDS):
+        spawn(i)
+    stop = asyncio.Event()
+    _stop_on_signals(stop)
+    sup = asyncio.create_task(supervise(stop))
+    try:
+        async with Bot(BOT_TOKEN) as bot:
+            if BOT_MODE == "webhook":
+                await serve_webhook(bot, deliver, health, stop)
+            else:
+                await poll_updates(bot, deliver, stop)
+    finally:
+        sup.cancel()
+        for q in queues:
+            q.put(None)
+        loop = asyncio.get_running_loop()
+        for p in procs:
+            await loop.run_in_executor(None, p.join, SHARD_JOIN_TIMEOUT)
+            if p.is_alive():
+                p.kill()   # shards SIGTERM ignore karte hain
+
+# =============== MAIN ===============
+# Handler groups = pipeline stages. PTB har group me pehla match chalata hai aur
+# phir agle group par jata hai, isliye har update track -> commands -> react se
+# guzarta hai (pehle sab group 0 me the aur tracking aksar chhoot jati thi).
+STAGE_TRACK    = -1   # chats_col registry: har message/post
+STAGE_COMMANDS = 0    # commands, callbacks, member updates
+STAGE_REACT    = 1    # mention filter + auto-reactions
+STAGE_NAMES = {STAGE_TRACK: "track", STAGE_COMMANDS: "commands", STAGE_REACT: "react"}
+
+def build_application(external_updates: bool = False) -> Application:
+    builder = Application.builder()\
         .token(BOT_TOKEN)\
-        .rate_limiter(AIORateLimiter())\
-        .build()
+        .rate_limiter(MeteredRateLimiter())\
+        .concurrent_updates(update_processor)\
+        .post_init(on_startup)\
+        .post_stop(on_stop)\
+        .post_shutdown(on_shutdown)
+    if external_updates:
+        # updates webhook server / router IPC se aate hain, Updater (getUpdates) nahi
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Commands
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("ping", ping))
+    app.add_handler(CommandHandler("perf", perf_cmd))
     app.add_handler(CommandHandler("addadmin", add_admin))
     app.add_handler(CommandHandler("deladmin", del_admin))
     app.add_handler(CommandHandler("admins", list_admins))
@@ -670,35 +3410,60 @@ def main():
     app.add_handler(CommandHandler("block", block_cmd))
     app.add_handler(CommandHandler("unblock", unblock_cmd))
     app.add_handler(CommandHandler("leave", leave_cmd))
+    app.add_handler(CommandHandler("exportchats", exportchats_cmd))
+    app.add_handler(CommandHandler("importchats", importchats_cmd))
     app.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    app.add_handler(CommandHandler("retryfailed", retryfailed_cmd))
+    app.add_handler(CommandHandler("schedule", schedule_cmd))
+    app.add_handler(CommandHandler("schedules", schedules_cmd))
+    app.add_handler(CommandHandler("unschedule", unschedule_cmd))
     app.add_handler(CommandHandler("reactions", list_reactions_cmd))
     app.add_handler(CommandHandler("addreaction", addreaction_cmd))
     app.add_handler(CommandHandler("delreaction", delreaction_cmd))
-
-    # Auto-reaction handlers
-    app.add_handler(MessageHandler(filters.ChatType.GROUPS, auto_react_for_group_mentions))
-    app.add_handler(MessageHandler(filters.ChatType.CHANNEL, auto_react_for_channel_posts))
+    app.add_handler(CommandHandler("chatreact", chatreact_cmd))
 
     # Track add/remove
     app.add_handler(ChatMemberHandler(my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
     app.add_handler(ChatMemberHandler(chat_member, ChatMemberHandler.CHAT_MEMBER))
 
-    # Menu callbacks
-    app.add_handler(CallbackQueryHandler(menu_cb, pattern="^menu:"))
+    # Menu callbacks (help_ pehle, warna "^menu:" use kha jata hai)
     app.add_handler(CallbackQueryHandler(help_menu_cb, pattern="^menu:help_"))
+    app.add_handler(CallbackQueryHandler(menu_cb, pattern="^menu:"))
+    app.add_handler(CallbackQueryHandler(broadcast_control_cb, pattern="^bcast:"))
     app.add_handler(CallbackQueryHandler(lambda u,c: u.callback_query.answer(), pattern="^noop$"))
 
     # Track chats on any message bot can see
-    app.add_handler(MessageHandler(filters.ALL, save_on_new_message))
-
-    # Polling
-    app.run_polling(
-        close_loop=False,
-        allowed_updates=[
-            "message", "channel_post", "my_chat_member", "chat_member",
-            "message_reaction", "message_reaction_count"
-        ]
-    )
+    app.add_handler(MessageHandler(filters.ALL, save_on_new_message, block=False), group=STAGE_TRACK)
+
+    # Auto-reactions (parallel-safe: sirf in-memory queue touch karte hain). Mention
+    # filter sync hai, to non-mention group messages par koi coroutine nahi banta.
+    app.add_handler(MessageHandler(filters.ChatType.GROUPS & (BOT_MENTIONED | REACT_ALL_CHAT),
+                                   auto_react_for_group_mentions, block=False), group=STAGE_REACT)
+    app.add_handler(MessageHandler(filters.ChatType.CHANNEL, auto_react_for_channel_posts, block=False),
+                    group=STAGE_REACT)
+
+    # per-handler + per-stage latency (/metrics, /perf)
+    for group, handlers in app.handlers.items():
+        for h in handlers:
+            h.callback = timed(h.callback, STAGE_NAMES.get(group, str(group)))
+    return app
+
+def main():
+    if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        raise RuntimeError("Please set BOT_TOKEN (env or constant).")
+
+    if SHARDS > 1:
+        asyncio.run(run_router())
+        return
+
+    app = build_application(external_updates=BOT_MODE == "webhook")
+    if BOT_MODE == "webhook":
+        health = lambda: {**update_backlog(app), **lifecycle}
+        asyncio.run(run_embedded(app, lambda stop: serve_webhook(app.bot, _app_deliver(app), health, stop)))
+        return
+
+    # Polling (fallback)
+    app.run_polling(close_loop=False, allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
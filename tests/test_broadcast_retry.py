@@ -0,0 +1,93 @@
+# Run crash (Mongo AutoReconnect) par part backoff ke baad cursor se resume hota hai;
+# BCAST_MAX_ERRORS ke baad terminal "error" + summary. Kisi chat ko do baar nahi bhejna.
+import os
+import sys
+import asyncio
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from pymongo.errors import AutoReconnect
+from mongomock_motor import AsyncMongoMockClient
+
+import bot
+
+NOTIFY = -1
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = Counter()
+        self.notes = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == NOTIFY:
+            self.notes.append(text)
+        else:
+            self.sent[chat_id] += 1
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock = AsyncMongoMockClient()["test"]
+    for attr, name in (("chats_col", bot.COL_CHATS), ("bcjobs_col", bot.COL_BCAST_JOBS),
+                       ("deliveries_col", bot.COL_BCAST_DELIV), ("bclogs_col", bot.COL_BCAST_LOGS),
+                       ("settings_col", bot.COL_SETTINGS)):
+        monkeypatch.setattr(bot, attr, mock[name])
+    monkeypatch.setattr(bot, "_bcast_wake", asyncio.Event())
+    monkeypatch.setattr(bot, "BCAST_RATE", 2000.0)
+    monkeypatch.setattr(bot, "CHAT_MIN_GAP", 0.0)
+    monkeypatch.setattr(bot, "BCAST_FETCH", 50)
+    monkeypatch.setattr(bot, "BCAST_ERROR_BACKOFF", 0.05)
+    monkeypatch.setattr(bot, "BCAST_POLL_INTERVAL", 0.05)
+    return mock
+
+
+def _flaky_batches(monkeypatch, fail):
+    real = bot._next_target_batch
+    calls = [0]
+
+    async def flaky(*args, **kwargs):
+        calls[0] += 1
+        if fail(calls[0]):
+            raise AutoReconnect("connection reset")
+        return await real(*args, **kwargs)
+
+    monkeypatch.setattr(bot, "_next_target_batch", flaky)
+
+
+async def _run_until_notified(tg):
+    await bot.chats_col.insert_many([{"_id": i} for i in range(1, 501)])
+    await bot.enqueue_broadcast("text", bot.OWNER_ID, NOTIFY, text="hi")
+    worker = asyncio.create_task(bot.broadcast_worker(type("App", (), {"bot": tg})()))
+    try:
+        for _ in range(200):
+            if tg.notes:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+    return await bot.bcjobs_col.find_one({})
+
+
+def test_transient_error_requeues_and_resumes(db, monkeypatch):
+    _flaky_batches(monkeypatch, lambda n: n == 5)
+    tg = FakeBot()
+    part = asyncio.run(_run_until_notified(tg))
+    assert part["status"] == "done" and part["errors"] == 1
+    assert len(tg.sent) == 500
+    assert max(tg.sent.values()) == 1
+    assert tg.notes and "Done" in tg.notes[0]
+
+
+def test_persistent_error_ends_in_error_and_notifies(db, monkeypatch):
+    _flaky_batches(monkeypatch, lambda n: True)
+    tg = FakeBot()
+    part = asyncio.run(_run_until_notified(tg))
+    assert part["status"] == "error" and part["errors"] == bot.BCAST_MAX_ERRORS
+    assert tg.notes and "error" in tg.notes[0]
@@ -0,0 +1,63 @@
+# Live status message: update sahi broadcast ke message par jana chahiye, chahe
+# collection me purane broadcasts bhi hon.
+#   pip install -r requirements.txt -r tests/requirements.txt
+#   python -m pytest -q tests
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import bot
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append((chat_id, message_id, text))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(bot, "chats_col", mock[bot.COL_CHATS])
+    monkeypatch.setattr(bot, "bcjobs_col", mock[bot.COL_BCAST_JOBS])
+    monkeypatch.setattr(bot, "deliveries_col", mock[bot.COL_BCAST_DELIV])
+    return mock
+
+
+async def _broadcast(message_id: int):
+    bid = await bot.enqueue_broadcast("text", bot.OWNER_ID, 1, text="hi")
+    await bot.bcjobs_col.update_many(
+        bot._parts_query(bid),
+        {"$set": {"status_chat_id": 1, "status_message_id": message_id, "progress_ts": 0.0}},
+    )
+    return bid
+
+
+def test_progress_edits_only_own_status_message(db):
+    async def main():
+        await bot.chats_col.insert_many([{"_id": i} for i in range(1, 11)])
+        old = await _broadcast(111)
+        new = await _broadcast(222)
+        tg = FakeBot()
+
+        await bot.update_broadcast_status(tg, new)
+
+        assert [e[1] for e in tg.edits] == [222]
+        assert str(new) in tg.edits[0][2]
+        old_head = await bot.bcjobs_col.find_one(bot._parts_query(old))
+        assert old_head["progress_ts"] == 0.0
+        new_head = await bot.bcjobs_col.find_one(bot._parts_query(new))
+        assert new_head["progress_ts"] > 0
+
+        # throttle window ke andar dusra update claim nahi karta
+        await bot.update_broadcast_status(tg, new)
+        assert len(tg.edits) == 1
+
+    asyncio.run(main())